@@ -0,0 +1,302 @@
+import os
+import math
+import time
+import asyncio
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from tracing import get_tracer
+
+# Window over which token quotas are counted
+TOKEN_WINDOW_SECONDS = 60.0
+
+
+def describe_wait(seconds):
+    """Human-readable duration for user-facing messages, rounded up like Retry-After."""
+    # Round once, then pick the unit, so the seconds/minutes switch follows the displayed value
+    seconds = max(math.ceil(seconds), 1)
+    if seconds < 90:
+        count, unit = seconds, "second"
+    else:
+        count, unit = math.ceil(seconds / 60), "minute"
+    return f"{count} {unit}" if count == 1 else f"{count} {unit}s"
+
+
+class AdmissionRejected(Exception):
+    """Raised when a report is shed instead of queued; the message is shown to the user."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Admits report requests against global and per-user concurrency and token-per-minute quotas.
+    Waiting requests are served fairly: the user served least recently goes first, and a user
+    at their own limit does not hold up others. Requests that could not start within `max_wait`
+    seconds, or that arrive when `max_queue` are already waiting, are shed.
+    Token quotas count each request's pre-flight estimate when it is admitted, and background
+    work reserved with try_reserve.
+    """
+
+    def __init__(self, max_concurrent=16, max_per_user=2, tokens_per_minute=0, user_tokens_per_minute=0,
+                 max_queue=32, max_wait=300.0):
+        """Initialize the controller; a quota of 0 means unlimited."""
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.tokens_per_minute = tokens_per_minute
+        self.user_tokens_per_minute = user_tokens_per_minute
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._changed = threading.Condition()
+        self._ids = itertools.count(1)
+        # Waiting tickets in arrival order, admitted tickets, and (time, user, tokens) reservations
+        self._queue = []
+        self._running = {}
+        self._reservations = deque()
+        self._last_served = {}
+        self._stats = {"admitted": 0, "shed": 0, "timed_out": 0, "wait_seconds": 0.0, "reserved_tokens": 0}
+
+    def enqueue(self, user_id, estimate):
+        """Queue a request or raise AdmissionRejected; returns a ticket for wait/release."""
+        tokens = estimate["total_tokens"]
+        with self._changed:
+            self._expire_reservations()
+            if self.tokens_per_minute and tokens > self.tokens_per_minute or \
+                    self.user_tokens_per_minute and tokens > self.user_tokens_per_minute:
+                self._stats["shed"] += 1
+                raise AdmissionRejected(
+                    f"This report needs about {tokens:,} tokens, more than the per-minute quota allows. "
+                    "Please select fewer topics."
+                )
+            if len(self._queue) >= self.max_queue:
+                self._stats["shed"] += 1
+                raise AdmissionRejected(
+                    f"The service is at capacity with {len(self._queue)} reports waiting. Please try again in a few minutes.",
+                    retry_after=60
+                )
+            if self.max_per_user and sum(1 for t in self._queue if t["user"] == user_id) >= self.max_per_user:
+                self._stats["shed"] += 1
+                raise AdmissionRejected("You already have reports waiting to start. Please wait for them to finish.",
+                                        retry_after=30)
+            ticket = {"id": next(self._ids), "user": user_id, "tokens": tokens,
+                      "latency": estimate["latency_seconds"], "enqueued": time.monotonic()}
+            wait = self._predict_wait(ticket)
+            if wait > self.max_wait:
+                self._stats["shed"] += 1
+                raise AdmissionRejected(
+                    f"The service is busy; this report would wait about {describe_wait(wait)} to start. "
+                    "Please try again later or select fewer topics.",
+                    retry_after=math.ceil(wait)
+                )
+            ticket["predicted_wait"] = wait
+            self._queue.append(ticket)
+            ticket["position"] = len(self._queue)
+            return ticket
+
+    def try_admit(self, ticket):
+        """Admit the ticket if it is next in fair order and within every quota."""
+        with self._changed:
+            return self._try_admit(ticket)
+
+    def wait(self, ticket, on_wait=None, poll=1.0):
+        """Block until the ticket is admitted; on_wait(position, seconds) is called while queued."""
+        deadline = ticket["enqueued"] + self.max_wait
+        while True:
+            with self._changed:
+                if self._try_admit(ticket):
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._time_out(ticket)
+                position, wait = self._position(ticket), self._predict_wait(ticket)
+                self._changed.wait(min(poll, remaining))
+            if on_wait is not None:
+                on_wait(position, wait)
+
+    async def wait_async(self, ticket, poll=0.25):
+        """Wait for admission from an event loop without tying up a thread per queued request."""
+        deadline = ticket["enqueued"] + self.max_wait
+        while not self.try_admit(ticket):
+            if time.monotonic() >= deadline:
+                with self._changed:
+                    self._time_out(ticket)
+            await asyncio.sleep(poll)
+
+    def try_reserve(self, user_id, tokens):
+        """
+        Count background work against the token quotas without queueing it.
+        Refused while requests are waiting or every slot is busy, or if the tokens would exceed a quota.
+        """
+        with self._changed:
+            self._expire_reservations()
+            if self._queue or self.max_concurrent and len(self._running) >= self.max_concurrent:
+                return False
+            if self.tokens_per_minute and \
+                    sum(t for _, _, t in self._reservations) + tokens > self.tokens_per_minute:
+                return False
+            if self.user_tokens_per_minute and \
+                    sum(t for _, u, t in self._reservations if u == user_id) + tokens > self.user_tokens_per_minute:
+                return False
+            self._reservations.append((time.monotonic(), user_id, tokens))
+            self._stats["reserved_tokens"] += tokens
+            return True
+
+    def cancel(self, ticket):
+        """Withdraw a queued ticket."""
+        with self._changed:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                self._changed.notify_all()
+
+    def release(self, ticket):
+        """Free the slot of an admitted ticket."""
+        with self._changed:
+            self._running.pop(ticket["id"], None)
+            self._changed.notify_all()
+
+    @contextmanager
+    def admit(self, user_id, estimate, on_wait=None):
+        """Hold an admission slot for the duration of the block, waiting in the queue if needed."""
+        with get_tracer().span("admission.wait", tokens=estimate["total_tokens"]) as span:
+            ticket = self.enqueue(user_id, estimate)
+            span.set_attributes({"predicted_wait": round(ticket["predicted_wait"], 1), "queue_position": ticket["position"]})
+            try:
+                self.wait(ticket, on_wait)
+            except BaseException:
+                self.cancel(ticket)
+                raise
+            span.set_attribute("waited", round(time.monotonic() - ticket["enqueued"], 3))
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def predict_wait(self, user_id, estimate):
+        """Seconds a new request would wait before starting, given the current load."""
+        with self._changed:
+            self._expire_reservations()
+            return self._predict_wait({"id": None, "user": user_id, "tokens": estimate["total_tokens"],
+                                       "latency": estimate["latency_seconds"]})
+
+    def stats(self):
+        """Return queue and running counts plus admission counters."""
+        with self._changed:
+            stats = dict(self._stats)
+            stats["queued"] = len(self._queue)
+            stats["running"] = len(self._running)
+            stats["window_tokens"] = sum(tokens for _, _, tokens in self._reservations)
+        stats["mean_wait_seconds"] = stats["wait_seconds"] / stats["admitted"] if stats["admitted"] else 0.0
+        return stats
+
+    def _try_admit(self, ticket):
+        """Admit the ticket if fair order and quotas allow it (caller holds the lock)."""
+        if ticket["id"] in self._running:
+            return True
+        self._expire_reservations()
+        if self._next_ticket() is not ticket:
+            return False
+        now = time.monotonic()
+        self._queue.remove(ticket)
+        ticket["started"] = now
+        self._running[ticket["id"]] = ticket
+        self._reservations.append((now, ticket["user"], ticket["tokens"]))
+        self._last_served[ticket["user"]] = now
+        self._stats["admitted"] += 1
+        self._stats["wait_seconds"] += now - ticket["enqueued"]
+        self._changed.notify_all()
+        return True
+
+    def _next_ticket(self):
+        """The waiting ticket to admit next, or None if nothing can start now."""
+        if self.max_concurrent and len(self._running) >= self.max_concurrent:
+            return None
+        window_tokens = sum(tokens for _, _, tokens in self._reservations)
+        heads = {}
+        for ticket in self._queue:
+            heads.setdefault(ticket["user"], ticket)
+        # Least recently served users first
+        for ticket in sorted(heads.values(), key=lambda t: (self._last_served.get(t["user"], 0.0), t["id"])):
+            user = ticket["user"]
+            if self.max_per_user and sum(1 for t in self._running.values() if t["user"] == user) >= self.max_per_user:
+                continue
+            if self.user_tokens_per_minute and \
+                    sum(tokens for _, u, tokens in self._reservations if u == user) + ticket["tokens"] > self.user_tokens_per_minute:
+                continue
+            if self.tokens_per_minute and window_tokens + ticket["tokens"] > self.tokens_per_minute:
+                # The global budget applies to everyone; later users must not overtake
+                return None
+            return ticket
+        return None
+
+    def _position(self, ticket):
+        """1-based position of a waiting ticket in arrival order."""
+        return self._queue.index(ticket) + 1 if ticket in self._queue else 0
+
+    def _predict_wait(self, ticket):
+        """Estimate seconds until the ticket can start (caller holds the lock)."""
+        now = time.monotonic()
+        ahead = [t for t in self._queue if t is not ticket]
+        busy = [max(t["latency"] - (now - t["started"]), 0.0) for t in self._running.values()]
+        slots = self.max_concurrent or len(busy) + len(ahead) + 1
+        # Work ahead of the ticket is spread over the concurrency slots
+        wait = 0.0
+        if len(busy) + len(ahead) >= slots:
+            wait = (sum(busy) + sum(t["latency"] for t in ahead)) / slots
+
+        # Token budget: wait until enough earlier reservations leave the window
+        needed = sum(t["tokens"] for t in ahead) + ticket["tokens"]
+        for budget, reservations in (
+            (self.tokens_per_minute, list(self._reservations)),
+            (self.user_tokens_per_minute, [r for r in self._reservations if r[1] == ticket["user"]]),
+        ):
+            if not budget:
+                continue
+            excess = sum(tokens for _, _, tokens in reservations) + needed - budget
+            for started, _, tokens in reservations:
+                if excess <= 0:
+                    break
+                excess -= tokens
+                wait = max(wait, started + TOKEN_WINDOW_SECONDS - now)
+        return wait
+
+    def _time_out(self, ticket):
+        """Drop a ticket that waited too long and raise (caller holds the lock)."""
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+        self._stats["timed_out"] += 1
+        self._changed.notify_all()
+        raise AdmissionRejected(
+            f"The service stayed busy for {describe_wait(self.max_wait)}, so this report was not started. "
+            "Please try again later.",
+            retry_after=60
+        )
+
+    def _expire_reservations(self):
+        """Drop reservations that have left the token window (caller holds the lock)."""
+        cutoff = time.monotonic() - TOKEN_WINDOW_SECONDS
+        while self._reservations and self._reservations[0][0] < cutoff:
+            self._reservations.popleft()
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """Return the process-wide admission controller, configured from ADMISSION_* environment variables."""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController(
+                max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", "16")),
+                max_per_user=int(os.getenv("ADMISSION_MAX_PER_USER", "2")),
+                tokens_per_minute=int(os.getenv("ADMISSION_TOKENS_PER_MINUTE", "0")),
+                user_tokens_per_minute=int(os.getenv("ADMISSION_USER_TOKENS_PER_MINUTE", "0")),
+                max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "32")),
+                max_wait=float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "300")),
+            )
+        return _controller
@@ -0,0 +1,424 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import bisect
+import itertools
+from array import array
+from finance_agent import FinanceAgent
+from admission import AdmissionController, AdmissionRejected
+
+# Reports running at once; further jobs wait in the "queued" state
+MAX_CONCURRENT_JOBS = int(os.getenv("API_MAX_CONCURRENT_JOBS", "256"))
+# Queued jobs before new ones are refused, and the longest expected wait accepted
+MAX_QUEUED_JOBS = int(os.getenv("API_MAX_QUEUED_JOBS", "1024"))
+MAX_WAIT_SECONDS = float(os.getenv("API_MAX_WAIT_SECONDS", "600"))
+# Per-caller limits for requests that send X-User-Id (0 = unlimited)
+MAX_JOBS_PER_USER = int(os.getenv("API_MAX_JOBS_PER_USER", "0"))
+USER_TOKENS_PER_MINUTE = int(os.getenv("API_USER_TOKENS_PER_MINUTE", "0"))
+# Estimated tokens admitted per minute across all jobs (0 = unlimited)
+TOKENS_PER_MINUTE = int(os.getenv("API_TOKENS_PER_MINUTE", "0"))
+# Seconds a finished job (and its event log) is kept for polling and replay
+JOB_TTL_SECONDS = int(os.getenv("API_JOB_TTL_SECONDS", "3600"))
+# Seconds between sweeps for expired jobs
+PURGE_INTERVAL_SECONDS = 60
+# Seconds between SSE keep-alive comments on idle streams
+SSE_KEEPALIVE_SECONDS = 15
+# Largest accepted request body
+MAX_BODY_BYTES = 64 * 1024
+
+
+class BodyTooLarge(ValueError):
+    """Raised when a request body exceeds MAX_BODY_BYTES."""
+
+
+class ReportJob:
+    """
+    A report being generated in the background.
+    Every event is appended to an in-memory log so any number of SSE clients
+    can replay it from the start (or from Last-Event-ID) and then follow live.
+    Once a section is finished, its token events are merged into one entry that keeps
+    their ids, so the log holds a few entries per section rather than one per token.
+    """
+
+    def __init__(self, report_title, company_data, selected_reports):
+        """Initialize a queued job."""
+        self.id = uuid.uuid4().hex
+        self.report_title = report_title
+        self.company_data = company_data
+        self.selected_reports = selected_reports
+        self.total_sections = sum(len(details) for details in selected_reports.values())
+        self.status = "queued"
+        self.sections_completed = 0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.estimate = None
+        self.ticket = None
+        # [first id, event, data, cumulative text offsets for merged tokens or None]
+        self.events = []
+        self._first_ids = []
+        self.next_id = 0
+        self.closed = False
+        self.task = None
+        self._changed = asyncio.Condition()
+
+    @property
+    def done(self):
+        """True once the job has completed or failed."""
+        return self.status in ("completed", "failed")
+
+    async def publish(self, event, data):
+        """Append an event to the log and wake up waiting streams."""
+        async with self._changed:
+            if event != "token":
+                self._merge_tokens()
+            self.events.append([self.next_id, event, data, None])
+            self._first_ids.append(self.next_id)
+            self.next_id += 1
+            self._changed.notify_all()
+
+    def _merge_tokens(self):
+        """Merge the run of token events at the end of the log (one section's) into one entry."""
+        start = len(self.events)
+        while start > 0 and self.events[start - 1][1] == "token" and self.events[start - 1][3] is None:
+            start -= 1
+        if len(self.events) - start < 2:
+            return
+        run = self.events[start:]
+        offsets = array("I", itertools.accumulate(len(entry[2]["text"]) for entry in run))
+        text = "".join(entry[2]["text"] for entry in run)
+        self.events[start:] = [[run[0][0], "token", {"section": run[0][2]["section"], "text": text}, offsets]]
+        del self._first_ids[start + 1:]
+
+    def events_after(self, last_id):
+        """Return [(id, event, data)] for events after last_id; a merged entry is cut where last_id falls inside it."""
+        pending = []
+        position = max(bisect.bisect_right(self._first_ids, last_id) - 1, 0)
+        for first_id, event, data, offsets in self.events[position:]:
+            end_id = first_id + len(offsets) - 1 if offsets else first_id
+            if end_id <= last_id:
+                continue
+            if offsets and last_id >= first_id:
+                data = dict(data, text=data["text"][offsets[last_id - first_id]:])
+            pending.append((end_id, event, data))
+        return pending
+
+    async def close(self):
+        """Mark the event log complete after the final event."""
+        async with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+    async def wait_for_events(self, last_id):
+        """Wait until there are events past last_id or the event log is closed."""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.next_id > last_id + 1 or self.closed)
+
+    def to_dict(self, include_result=True):
+        """Describe the job for the status endpoint."""
+        body = {
+            "id": self.id,
+            "status": self.status,
+            "sections_completed": self.sections_completed,
+            "total_sections": self.total_sections,
+            "created": self.created,
+            "finished": self.finished,
+            "links": {"self": f"/reports/{self.id}", "events": f"/reports/{self.id}/events"},
+        }
+        if self.estimate:
+            body["estimate"] = self.estimate
+        if self.error:
+            body["error"] = self.error
+        if include_result and self.result is not None:
+            body["result"] = self.result
+        return body
+
+
+class ReportService:
+    """Runs report jobs on the event loop with a shared agent; its admission controller bounds concurrency."""
+
+    def __init__(self, agent=None, max_concurrent=MAX_CONCURRENT_JOBS, job_ttl=JOB_TTL_SECONDS, admission=None):
+        """Initialize the service with the shared agent and limits."""
+        self.agent = agent or FinanceAgent(model=os.getenv("OPENAI_MODEL", "gpt-4o"))
+        # The API has its own limits, separate from the Streamlit app's ADMISSION_* settings
+        self.admission = admission or AdmissionController(
+            max_concurrent=max_concurrent,
+            max_per_user=MAX_JOBS_PER_USER,
+            tokens_per_minute=TOKENS_PER_MINUTE,
+            user_tokens_per_minute=USER_TOKENS_PER_MINUTE,
+            max_queue=MAX_QUEUED_JOBS,
+            max_wait=MAX_WAIT_SECONDS,
+        )
+        self.job_ttl = job_ttl
+        self.jobs = {}
+        self._purger = None
+
+    async def create(self, report_title, company_data, selected_reports, user_id=None):
+        """
+        Register a job and start it in the background; raises AdmissionRejected if it is shed.
+        Jobs without a user_id are not subject to per-user limits.
+        """
+        self._purge_expired()
+        # Off the event loop: the tokenizer may load (or download) its encoding and the
+        # industry cache lookup is a SQLite read
+        estimate = await asyncio.to_thread(self.agent.estimate_report, company_data, selected_reports)
+        job = ReportJob(report_title, company_data, selected_reports)
+        ticket = self.admission.enqueue(user_id or f"job:{job.id}", estimate)
+        job.estimate = dict(estimate, expected_wait_seconds=round(ticket["predicted_wait"], 1))
+        job.ticket = ticket
+        self.jobs[job.id] = job
+        loop = asyncio.get_running_loop()
+        job.task = loop.create_task(self._run(job))
+        if self._purger is None:
+            self._purger = loop.create_task(self._purge_periodically())
+        return job
+
+    async def _run(self, job):
+        """Wait for admission, then generate the report, publishing progress and tokens as events."""
+        try:
+            # Stays "queued" until the admission controller has a slot within the quotas
+            await self.admission.wait_async(job.ticket)
+            job.status = "running"
+            await job.publish("status", {"status": job.status})
+            async for event, data in self.agent.stream_financial_report(
+                job.report_title, job.company_data, job.selected_reports
+            ):
+                if event == "section_completed":
+                    job.sections_completed = data["index"]
+                if event == "report":
+                    job.result = data["content"]
+                    continue
+                await job.publish(event, data)
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "failed"
+            job.error = "cancelled"
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            self.admission.cancel(job.ticket)
+            self.admission.release(job.ticket)
+            job.finished = time.time()
+            await job.publish("done", job.to_dict(include_result=False))
+            await job.close()
+
+    def _purge_expired(self):
+        """Forget finished jobs older than the TTL."""
+        cutoff = time.time() - self.job_ttl
+        for job_id in [j.id for j in self.jobs.values() if j.done and j.finished < cutoff]:
+            del self.jobs[job_id]
+
+    async def _purge_periodically(self):
+        """Purge expired jobs on a timer, so memory is freed even when no new jobs arrive."""
+        while True:
+            await asyncio.sleep(PURGE_INTERVAL_SECONDS)
+            self._purge_expired()
+
+    async def shutdown(self):
+        """Cancel jobs that are still running."""
+        tasks = [job.task for job in self.jobs.values() if job.task and not job.task.done()]
+        if self._purger is not None:
+            tasks.append(self._purger)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def parse_report_request(body):
+    """Validate a POST /reports body and return (title, company_data, selected_reports)."""
+    company = body.get("company") or {}
+    missing = [field for field in ("name", "industry", "financials") if not str(company.get(field, "")).strip()]
+    if missing:
+        raise ValueError(f"company is missing: {', '.join(missing)}")
+
+    topics = body.get("topics")
+    if not isinstance(topics, list) or not topics or not all(isinstance(t, str) and t.strip() for t in topics):
+        raise ValueError("topics must be a non-empty list of topic names")
+
+    company_data = {
+        "name": str(company["name"]).strip(),
+        "industry": str(company["industry"]).strip(),
+        "financials": str(company["financials"]).strip(),
+    }
+    title = str(body.get("title") or "Comprehensive Financial Analysis")
+    return title, company_data, {"Comprehensive Analysis": [t.strip() for t in topics]}
+
+
+def request_user(scope):
+    """
+    Identify the caller for per-user limits by the X-User-Id header, or None without one.
+    The client address is not used: behind a proxy or load balancer every caller would share it.
+    """
+    headers = dict(scope.get("headers") or [])
+    return headers.get(b"x-user-id", b"").decode("latin-1").strip() or None
+
+
+async def read_body(receive):
+    """Read the full request body, refusing anything over MAX_BODY_BYTES."""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ConnectionError("client disconnected")
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise BodyTooLarge("request body too large")
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def send_json(send, status, body, headers=None):
+    """Send a complete JSON response."""
+    data = json.dumps(body).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(data)).encode()),
+        ] + (headers or []),
+    })
+    await send({"type": "http.response.body", "body": data})
+
+
+def format_sse(event_id, event, data):
+    """Encode one server-sent event."""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+async def stream_events(job, scope, receive, send):
+    """Replay a job's events and follow it live as a server-sent event stream."""
+    # Resume after the last event the client saw
+    headers = dict(scope.get("headers") or [])
+    try:
+        last_id = int(headers.get(b"last-event-id", b"-1"))
+    except ValueError:
+        last_id = -1
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ],
+    })
+
+    async def wait_for_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    disconnect = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        while True:
+            pending = job.events_after(last_id)
+            if pending:
+                payload = b"".join(format_sse(event_id, event, data) for event_id, event, data in pending)
+                await send({"type": "http.response.body", "body": payload, "more_body": True})
+                last_id = pending[-1][0]
+            if job.closed and last_id >= job.next_id - 1:
+                break
+
+            waiter = asyncio.ensure_future(job.wait_for_events(last_id))
+            finished, _ = await asyncio.wait(
+                {waiter, disconnect},
+                timeout=SSE_KEEPALIVE_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if disconnect in finished:
+                waiter.cancel()
+                return
+            if not finished:
+                waiter.cancel()
+                await send({"type": "http.response.body", "body": b": keep-alive\n\n", "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        disconnect.cancel()
+
+
+def create_app(service_factory=ReportService):
+    """Build the ASGI application; the service is created on lifespan startup."""
+    state = {}
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    state["service"] = service_factory()
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    if "service" in state:
+                        await state["service"].shutdown()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+
+        # Servers without lifespan support get the service on first request
+        if "service" not in state:
+            state["service"] = service_factory()
+        service = state["service"]
+        method = scope["method"]
+        parts = [p for p in scope["path"].split("/") if p]
+
+        if parts == ["health"] and method == "GET":
+            running = sum(1 for j in service.jobs.values() if j.status == "running")
+            await send_json(send, 200, {"status": "ok", "jobs": len(service.jobs), "running": running})
+        elif parts == ["reports"] and method == "POST":
+            try:
+                body = json.loads(await read_body(receive) or b"{}")
+                if not isinstance(body, dict):
+                    raise ValueError("request body must be a JSON object")
+                report_title, company_data, selected_reports = parse_report_request(body)
+            except ConnectionError:
+                return
+            except BodyTooLarge as e:
+                await send_json(send, 413, {"error": str(e)})
+                return
+            except ValueError as e:
+                await send_json(send, 400, {"error": str(e)})
+                return
+            try:
+                job = await service.create(report_title, company_data, selected_reports, user_id=request_user(scope))
+            except AdmissionRejected as e:
+                headers = [(b"retry-after", str(e.retry_after).encode())] if e.retry_after else []
+                await send_json(send, 429, {"error": str(e)}, headers=headers)
+                return
+            await send_json(send, 202, job.to_dict(), headers=[(b"location", f"/reports/{job.id}".encode())])
+        elif len(parts) in (2, 3) and parts[0] == "reports" and method == "GET":
+            job = service.jobs.get(parts[1])
+            if job is None:
+                await send_json(send, 404, {"error": "report not found"})
+            elif len(parts) == 2:
+                await send_json(send, 200, job.to_dict())
+            elif parts[2] == "events":
+                await stream_events(job, scope, receive, send)
+            else:
+                await send_json(send, 404, {"error": "not found"})
+        else:
+            await send_json(send, 404, {"error": "not found"})
+
+    return app
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(
+        "api:app",
+        host=os.getenv("API_HOST", "127.0.0.1"),
+        port=int(os.getenv("API_PORT", "8000")),
+        log_level="info"
+    )
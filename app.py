@@ -1,16 +1,22 @@
 import streamlit as st
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import os
 import openai
 from dotenv import load_dotenv
-import pandas as pd
-import plotly.express as px
 import json
 import random
 from finance_agent import FinanceAgent
+from tracing import get_tracer
+from report_store import get_report_store
+from speculation import get_speculative_cache, speculation_enabled
+from report_topics import REPORT_TOPICS, TOPIC_CATEGORIES
+from charts import get_charts_html
+from admission import get_admission_controller, AdmissionRejected, describe_wait
+import uuid
 from datetime import datetime
 import tempfile
 import markdown
-import base64
 import time
 import re
 
@@ -20,26 +26,25 @@ load_dotenv()
 # Set OpenAI API key - updated to check both .env and secrets.toml
 if os.getenv("OPENAI_API_KEY"):
     openai.api_key = os.getenv("OPENAI_API_KEY")
+elif os.getenv("LLM_CASSETTE_MODE") == "replay":
+    # Replaying a recorded cassette needs no real API key
+    openai.api_key = "cassette-replay"
 elif hasattr(st, "secrets") and "OPENAI_API_KEY" in st.secrets:
     openai.api_key = st.secrets["OPENAI_API_KEY"]
 else:
     openai.api_key = None
 
-# Check OpenAI version and set appropriate client
-try:
-    # Check if we're using OpenAI v1.x.x
-    from openai import __version__
-    USING_NEW_OPENAI = int(__version__.split('.')[0]) >= 1
-    if USING_NEW_OPENAI:
-        # For OpenAI v1.x.x, create a client instance
-        from openai import OpenAI
-        client = OpenAI(api_key=openai.api_key)
-except:
-    USING_NEW_OPENAI = False
+# Fragments arrived as st.experimental_fragment and were later renamed to st.fragment
+fragment = getattr(st, "fragment", None) or st.experimental_fragment
 
 # Function to convert markdown to HTML
-def markdown_to_html(markdown_text, company_name=None):
+def markdown_to_html(markdown_text, company_name=None, charts_html=""):
     """Convert markdown to HTML with minimal formatting."""
+    with get_tracer().span("app.markdown_to_html", chars=len(markdown_text)):
+        return _markdown_to_html(markdown_text, company_name, charts_html)
+
+def _markdown_to_html(markdown_text, company_name=None, charts_html=""):
+    """Render the markdown report into a standalone HTML page."""
     # Use basic markdown extensions
     extensions = [
         'markdown.extensions.tables',
@@ -112,6 +117,7 @@ def markdown_to_html(markdown_text, company_name=None):
     <body>
         <h1>{title}</h1>
         {html.replace('<h2>Comprehensive Financial Analysis</h2>', '').replace('<h2>Comprehensive Analysis</h2>', '').replace('<h1>Comprehensive Financial Analysis</h1>', '')}
+        {f"<h2>Key Metrics</h2>{charts_html}" if charts_html else ""}
         <footer>
             <p><small>Generated on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</small></p>
         </footer>
@@ -121,6 +127,44 @@ def markdown_to_html(markdown_text, company_name=None):
     
     return html
 
+# Function to split the generated report on topic headings and join the parts with separators
+def split_report_sections(comprehensive_report, selected_topics):
+    """Insert horizontal rules between topic sections of the report."""
+    with get_tracer().span("app.post_process", chars=len(comprehensive_report), topics=len(selected_topics)):
+        # Split the report by headings (# or ## followed by any of the selected topics)
+        sections = []
+        current_section = ""
+        lines = comprehensive_report.split('\n')
+
+        for line in lines:
+            # Check if this line is a heading for one of our topics
+            is_heading = False
+            for topic in selected_topics:
+                if (line.startswith('# ' + topic) or 
+                    line.startswith('## ' + topic) or 
+                    line == '# ' + topic or 
+                    line == '## ' + topic):
+                    is_heading = True
+                    # If we have content in the current section, add it to sections
+                    if current_section:
+                        sections.append(current_section)
+                    # Start a new section with this heading
+                    current_section = line + '\n'
+                    break
+
+            if not is_heading:
+                # Add this line to the current section
+                current_section += line + '\n'
+
+        # Add the last section
+        if current_section:
+            sections.append(current_section)
+
+        # Join sections with horizontal rules
+        comprehensive_report = '\n\n---\n\n'.join(sections)
+        
+        return comprehensive_report
+
 # App title and configuration
 st.set_page_config(
     page_title="Private Equity AI Assistant",
@@ -130,7 +174,10 @@ st.set_page_config(
 )
 
 # Custom CSS with header size adjustment (no color changes)
-st.markdown("""
+@st.cache_resource
+def get_page_css():
+    """Page stylesheet, built once per process."""
+    return """
 <style>
     /* Header styling - increased size only */
     .main-header {
@@ -247,14 +294,24 @@ st.markdown("""
         display: block;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+st.markdown(get_page_css(), unsafe_allow_html=True)
+
+# One agent for the whole process - it holds no per-session state
+@st.cache_resource
+def get_finance_agent():
+    """Create the FinanceAgent shared by every session."""
+    return FinanceAgent(model=os.getenv("OPENAI_MODEL", "gpt-4o"))
 
-# Initialize session state
-if 'finance_agent' not in st.session_state:
-    st.session_state.finance_agent = FinanceAgent(model=os.getenv("OPENAI_MODEL", "gpt-4o"))
+# Initialize session state - sessions keep only lightweight handles into the shared report store
+if 'session_id' not in st.session_state:
+    # Streamlit's own session id, so reports can be released once the runtime closes the session
+    ctx = get_script_run_ctx()
+    st.session_state.session_id = ctx.session_id if ctx else uuid.uuid4().hex
 
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
+if 'report_handles' not in st.session_state:
+    st.session_state.report_handles = []
 
 
 MOCK_COMPANY_NAMES = [
@@ -334,95 +391,104 @@ if not openai.api_key:
     st.stop()
 
 
-# Add button to generate interrelated data - centered
-col1, col2, col3 = st.columns([1, 2, 1])
-with col2:
-    if st.button("Generate Example Data", key="generate_example"):
-        company_name, industry, financials = generate_interrelated_data()
-        st.session_state['company_name'] = company_name
-        st.session_state['company_industry'] = industry
-        st.session_state['company_financials'] = financials
-
-# Create two columns for company name and industry
-col1, col2 = st.columns(2)
+# Button callback - fills the inputs before they are drawn on the next run
+def fill_example_data():
+    """Fill the company inputs with a random example company."""
+    company_name, industry, financials = generate_interrelated_data()
+    st.session_state['input_company_name'] = company_name
+    st.session_state['input_company_industry'] = industry
+    st.session_state['input_company_financials'] = financials
 
-with col1:
-    company_name = st.text_input("Company Name:", value=st.session_state.get('company_name', ''), key="input_company_name")
+# Company inputs - editing them reruns only this fragment, not the whole page
+@fragment
+def company_inputs():
+    """Draw the example data button and the company name, industry and financials inputs."""
+    # Add button to generate interrelated data - centered
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col2:
+        st.button("Generate Example Data", key="generate_example", on_click=fill_example_data)
     
-with col2:
-    company_industry = st.text_input("Industry:", value=st.session_state.get('company_industry', ''), key="input_company_industry")
-
-# Financial information field - outside of columns to span across the page
-company_financials = st.text_area(
-    "Financial Information:", 
-    value=st.session_state.get('company_financials', ''),
-    height=150,
-    placeholder="Enter key financial metrics, performance data, etc.",
-    key="input_company_financials"
-)
+    # Create two columns for company name and industry
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.text_input("Company Name:", key="input_company_name")
+    
+    with col2:
+        st.text_input("Industry:", key="input_company_industry")
+    
+    # Financial information field - outside of columns to span across the page
+    st.text_area(
+        "Financial Information:", 
+        height=150,
+        placeholder="Enter key financial metrics, performance data, etc.",
+        key="input_company_financials"
+    )
+    
+    # Pre-generate common sections once the inputs settle (opt-in with SPECULATIVE_GENERATION=1)
+    if speculation_enabled():
+        get_speculative_cache(get_finance_agent()).observe(st.session_state.session_id, {
+            "name": st.session_state.get('input_company_name', ''),
+            "industry": st.session_state.get('input_company_industry', ''),
+            "financials": st.session_state.get('input_company_financials', '')
+        })
+
+company_inputs()
+company_name = st.session_state.get('input_company_name', '')
+company_industry = st.session_state.get('input_company_industry', '')
+company_financials = st.session_state.get('input_company_financials', '')
     
 # Button to generate comprehensive report - centered
 col1, col2, col3 = st.columns([1, 2, 1])
 with col2:
     generate_comprehensive_btn = st.button("Generate Financial Analysis", key="generate_comprehensive")
 
-# Add unified report topics with descriptions
-unified_report_topics = {
-    "Executive Summary": "A concise overview of the company's financial position, key strengths, risks, and investment potential.",
-    "Company Overview": "Background information on the company's history, business model, products/services, and market positioning.",
-    "Industry Analysis": "Assessment of industry trends, market size, growth rates, and key success factors in the company's sector.",
-    "Financial Performance & Metrics": "Detailed analysis of revenue, profitability, cash flow, and key financial ratios with historical context.",
-    "Valuation Analysis": "Estimation of company value using multiple methodologies (DCF, comparable companies, precedent transactions).",
-    "Capital Structure & Debt Profile": "Analysis of the company's debt, equity, leverage ratios, and financing options.",
-    "Operational Assessment": "Evaluation of operational efficiency, production capacity, supply chain, and cost structure.",
-    "Management & Governance": "Assessment of leadership team, board composition, decision-making processes, and corporate governance.",
-    "Legal & Regulatory Considerations": "Overview of legal compliance, regulatory environment, and potential legal risks or opportunities.",
-    "Market Position & Competitive Analysis": "Evaluation of market share, competitive advantages, and positioning relative to competitors.",
-    "Customer & Supplier Relationships": "Analysis of customer concentration, supplier dependencies, and relationship management.",
-    "Risk Assessment & Mitigation Strategies": "Identification of key business, financial, and market risks with mitigation approaches.",
-    "Growth Opportunities & Forecasts": "Projection of future performance and identification of growth avenues and expansion potential.",
-    "Investment Thesis & Recommendations": "Strategic rationale for investment with clear recommendations and expected returns.",
-    "Exit Strategy Considerations": "Analysis of potential exit options, timing, and value creation opportunities for investors."
-}
+# Topic catalog with the sidebar HTML rendered once per process
+@st.cache_resource
+def get_topic_catalog():
+    """Return [(category, [(topic, description_html), ...]), ...] for the sidebar."""
+    return [
+        (category, [
+            (topic, f"<div class='topic-description'>{REPORT_TOPICS[topic]}</div>")
+            for topic in topics if topic in REPORT_TOPICS
+        ])
+        for category, topics in TOPIC_CATEGORIES.items()
+    ]
 
-# Sidebar for selecting unified report topics
-st.sidebar.markdown("<h3 style='margin-bottom: 15px;'>Select Report Topics</h3>", unsafe_allow_html=True)
-
-# Add a "Select All Topics" checkbox
-select_all_topics = st.sidebar.checkbox("Select All Topics")
-
-# Organize topics into categories
-topic_categories = {
-    "Overview": ["Executive Summary", "Company Overview"],
-    "Market Analysis": ["Industry Analysis", "Market Position & Competitive Analysis"],
-    "Financial Analysis": ["Financial Performance & Metrics", "Valuation Analysis", "Capital Structure & Debt Profile"],
-    "Operations": ["Operational Assessment", "Management & Governance", "Customer & Supplier Relationships"],
-    "Risk & Growth": ["Risk Assessment & Mitigation Strategies", "Growth Opportunities & Forecasts", "Legal & Regulatory Considerations"],
-    "Investment": ["Investment Thesis & Recommendations", "Exit Strategy Considerations"]
-}
-
-# Display topics by category
-selected_topics = []
-
-for category, topics in topic_categories.items():
-    st.sidebar.markdown(f"<div class='category-header'>{category}</div>", unsafe_allow_html=True)
+# Topic selection - ticking a checkbox reruns only this fragment
+@fragment
+def topic_selector():
+    """Draw the topic checkboxes grouped by category."""
+    st.markdown("<h3 style='margin-bottom: 15px;'>Select Report Topics</h3>", unsafe_allow_html=True)
     
-    for topic in topics:
-        if topic in unified_report_topics:
-            description = unified_report_topics[topic]
-            
+    # Add a "Select All Topics" checkbox
+    select_all_topics = st.checkbox("Select All Topics", key="select_all_topics")
+    
+    # Display topics by category
+    for category, topics in get_topic_catalog():
+        st.markdown(f"<div class='category-header'>{category}</div>", unsafe_allow_html=True)
+        
+        for topic, description_html in topics:
             # Create expander for each topic
-            with st.sidebar.expander(topic):
-                st.markdown(f"<div class='topic-description'>{description}</div>", unsafe_allow_html=True)
+            with st.expander(topic):
+                st.markdown(description_html, unsafe_allow_html=True)
                 
                 # Add checkbox inside expander
-                if select_all_topics:
-                    topic_selected = True
-                else:
-                    topic_selected = st.checkbox("Select this topic", key=f"topic_{topic}")
-                
-                if topic_selected:
-                    selected_topics.append(topic)
+                if not select_all_topics:
+                    st.checkbox("Select this topic", key=f"topic_{topic}")
+
+# Sidebar for selecting unified report topics
+with st.sidebar:
+    topic_selector()
+
+# Read the selection back from the widget state
+select_all_topics = st.session_state.get('select_all_topics', False)
+selected_topics = [
+    topic
+    for category, topics in get_topic_catalog()
+    for topic, description_html in topics
+    if select_all_topics or st.session_state.get(f"topic_{topic}", False)
+]
 
 # Convert selected topics to the format expected by finance_agent.py
 if selected_topics:
@@ -437,95 +503,150 @@ if generate_comprehensive_btn:
         if not selected_topics:
             st.warning("Please select at least one report topic in the sidebar.")
         else:
-            # Create a single progress bar and status text that will be used by finance_agent.py
-            progress_container = st.container()
-            with progress_container:
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                                
-                # Store progress bar and status text in session state for access by finance_agent.py
-                st.session_state['_progress_bar'] = progress_bar
-                st.session_state['_status_text'] = status_text
+            # Trace the whole request so generation, post-processing and HTML conversion share one timeline
+            with get_tracer().span("app.generate_report", company=company_name, topics=len(selected_topics)):
+                # Create a single progress bar and status text that will be used by finance_agent.py
+                progress_container = st.container()
+                with progress_container:
+                    progress_bar = st.progress(0)
+                    status_text = st.empty()
                 
-                # Prepare company data
-                company_data = {
-                    "name": company_name,
-                    "industry": company_industry,
-                    "financials": company_financials
-                }
+                    # Prepare company data
+                    company_data = {
+                        "name": company_name,
+                        "industry": company_industry,
+                        "financials": company_financials
+                    }
                 
-                # Add note about non-repetitive report generation
-                info_message = st.info("Generating a comprehensive report based on the selected topics.")
+                    # Estimate tokens and duration before any call is made and tell the user
+                    estimate = get_finance_agent().estimate_report(company_data, selected_reports)
+                    eta_text = (
+                        f"Generating a comprehensive report based on the selected topics: about "
+                        f"{estimate['total_tokens']:,} tokens, expected to take {describe_wait(estimate['latency_seconds'])}."
+                    )
+                    info_message = st.empty()
+                    info_message.info(eta_text)
                 
-                # Generate comprehensive report based on selected options
-                comprehensive_report = st.session_state.finance_agent.generate_financial_report(
-                    "Comprehensive Financial Analysis",
-                    company_data,
-                    "text",
-                    selected_reports
-                )
+                    # Wait for a slot within the global and per-user quotas, or shed the request
+                    comprehensive_report = None
+                    try:
+                        with get_admission_controller().admit(
+                            st.session_state.session_id,
+                            estimate,
+                            on_wait=lambda position, wait: info_message.info(
+                                f"The service is busy. Your report is number {position} in the queue and should start "
+                                f"in about {describe_wait(wait)}, then take {describe_wait(estimate['latency_seconds'])}."
+                            )
+                        ):
+                            info_message.info(eta_text)
+                        
+                            # Pick up sections speculatively generated while topics were being selected
+                            precomputed_sections = {}
+                            if speculation_enabled():
+                                precomputed_sections = get_speculative_cache(get_finance_agent()).take(
+                                    st.session_state.session_id,
+                                    company_data,
+                                    selected_topics
+                                )
+                        
+                            # Generate comprehensive report based on selected options
+                            comprehensive_report = get_finance_agent().generate_financial_report(
+                                "Comprehensive Financial Analysis",
+                                company_data,
+                                "text",
+                                selected_reports,
+                                precomputed_sections
+                            )
+                    except AdmissionRejected as e:
+                        st.error(str(e))
                 
-                # Clear the info message once the report is generated
-                info_message.empty()
+                    # Clear the info message once the report is generated
+                    info_message.empty()
                 
-                # Add separators between topics in the report
-                if comprehensive_report:
-                    # Split the report by headings (# or ## followed by any of the selected topics)
-                    sections = []
-                    current_section = ""
-                    lines = comprehensive_report.split('\n')
-                    
-                    for line in lines:
-                        # Check if this line is a heading for one of our topics
-                        is_heading = False
-                        for topic in selected_topics:
-                            if (line.startswith('# ' + topic) or 
-                                line.startswith('## ' + topic) or 
-                                line == '# ' + topic or 
-                                line == '## ' + topic):
-                                is_heading = True
-                                # If we have content in the current section, add it to sections
-                                if current_section:
-                                    sections.append(current_section)
-                                # Start a new section with this heading
-                                current_section = line + '\n'
-                                break
-                        
-                        if not is_heading:
-                            # Add this line to the current section
-                            current_section += line + '\n'
-                    
-                    # Add the last section
-                    if current_section:
-                        sections.append(current_section)
-                    
-                    # Join sections with horizontal rules
-                    comprehensive_report = '\n\n---\n\n'.join(sections)
+                    # Add separators between topics in the report
+                    if comprehensive_report:
+                        comprehensive_report = split_report_sections(comprehensive_report, selected_topics)
                 
-                # Update progress to completion
-                progress_bar.progress(1.0)
-                status_text.text("Report completed!")
+                    # Update progress to completion
+                    progress_bar.progress(1.0)
+                    status_text.text("Report completed!")
                 
-                # Clear progress indicators immediately
-                progress_bar.empty()
-                status_text.empty()
+                    # Clear progress indicators immediately
+                    progress_bar.empty()
+                    status_text.empty()
             
-            # Display the report directly without conversion
-            if comprehensive_report:
-                st.success("The report has been generated successfully with the selected topics!")
-                html_content = markdown_to_html(comprehensive_report, company_name)
-                if html_content:
-                    html_filename = f"financial_analysis_{company_name.replace(' ', '_').lower()}.html"
-                    st.download_button(
-                        label="Download HTML Report",
-                        data=html_content,
-                        file_name=html_filename,
-                        mime="text/html"
-                    )
-                else:
-                    st.error("Failed to convert report to HTML.")
+                # Keep the report in the shared store and only its handle in the session
+                if comprehensive_report:
+                    # Charts are rendered once per financials text and shared by the page and the export
+                    charts_html = get_charts_html(company_financials)
+                    html_content = markdown_to_html(comprehensive_report, company_name, charts_html)
+                    if html_content:
+                        report_id = get_report_store().put(
+                            st.session_state.session_id,
+                            comprehensive_report,
+                            html_content,
+                            company_name,
+                            charts_html
+                        )
+                        st.session_state.report_handles.append(report_id)
+                        st.success("The report has been generated successfully with the selected topics!")
+                    else:
+                        st.error("Failed to convert report to HTML.")
     else:
         st.warning("Please provide all company information fields.")
 
+# Offer the latest report that is still held by the store
+report_store = get_report_store()
+if Runtime.exists():
+    # Any session's rerun also releases the reports of sessions that have since closed
+    report_store.drop_closed_sessions(Runtime.instance().is_active_session)
+st.session_state.report_handles = report_store.live_handles(st.session_state.report_handles)
+if st.session_state.report_handles:
+    latest_report = report_store.get(st.session_state.report_handles[-1])
+    if latest_report:
+        if latest_report["charts_html"]:
+            st.markdown("### Key Metrics")
+            st.markdown(latest_report["charts_html"], unsafe_allow_html=True)
+        report_company = latest_report["company_name"] or "report"
+        html_filename = f"financial_analysis_{report_company.replace(' ', '_').lower()}.html"
+        st.download_button(
+            label="Download HTML Report",
+            data=latest_report["html"],
+            file_name=html_filename,
+            mime="text/html"
+        )
+
+# Memory panel for operators, enabled with SHOW_MEMORY_PANEL=1
+if os.getenv("SHOW_MEMORY_PANEL", "").lower() in ("1", "true", "yes"):
+    with st.sidebar.expander("Memory usage"):
+        memory = report_store.memory_report()
+        st.markdown(
+            f"**{memory['total_bytes'] / 2**20:.1f} MB** of {memory['max_bytes'] / 2**20:.0f} MB held "
+            f"in {memory['reports']} reports ({memory['evictions']} evicted)"
+        )
+        if memory["sessions"]:
+            # A markdown table rather than st.table, which needs pyarrow
+            rows = "".join(
+                f"| {s['session']} | {s['reports']} | {s['bytes'] / 2**20:.2f} |\n" for s in memory["sessions"]
+            )
+            st.markdown("| Session | Reports | MB |\n|---|---|---|\n" + rows)
+    with st.sidebar.expander("Admission"):
+        admission = get_admission_controller().stats()
+        st.markdown(
+            f"**{admission['running']}** running, **{admission['queued']}** queued, "
+            f"{admission['window_tokens']:,} tokens admitted in the last minute. "
+            f"{admission['admitted']} admitted (mean wait {admission['mean_wait_seconds']:.1f}s), "
+            f"{admission['shed']} shed, {admission['timed_out']} timed out"
+        )
+    if speculation_enabled():
+        with st.sidebar.expander("Speculative generation"):
+            speculation = get_speculative_cache(get_finance_agent()).stats()
+            hit_rate = "n/a" if speculation["hit_rate"] is None else f"{speculation['hit_rate']:.0%}"
+            st.markdown(
+                f"**{hit_rate}** hit rate: {speculation['used']} sections used, {speculation['wasted']} wasted, "
+                f"{speculation['cancelled']} cancelled before starting, {speculation['missed']} generated on request "
+                f"({speculation['pending']} pending, {speculation['skipped']} skipped while busy)"
+            )
+
 # Footer with improved styling
 st.markdown("---")
\ No newline at end of file
@@ -0,0 +1,200 @@
+import os
+import sys
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import threading
+from types import SimpleNamespace
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode when a request was never recorded."""
+
+
+def fingerprint(request):
+    """Stable hash of a chat.completions.create request (model, messages, sampling options)."""
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    Recorded chat completion calls in a gzip-compressed JSON Lines file.
+    Each entry holds the request fingerprint, the full response (or stream chunks)
+    including usage, and the timing needed to reproduce the original latency.
+    """
+
+    def __init__(self, path, mode, latency_scale=0.0):
+        """Open a cassette for "record" or "replay"; latency_scale 1.0 replays original timing."""
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        # fingerprint -> recorded entries, and how many times each was played back
+        self._entries = {}
+        self._plays = {}
+        if mode == "replay":
+            for entry in load_entries(path):
+                self._entries.setdefault(entry["fingerprint"], []).append(entry)
+
+    def record(self, request, entry):
+        """Append a recorded call to the cassette file."""
+        entry = dict(entry, fingerprint=fingerprint(request), model=request.get("model"),
+                     max_tokens=request.get("max_tokens"), stream=bool(request.get("stream")))
+        line = json.dumps(entry, separators=(",", ":"), default=str)
+        with self._lock:
+            # Each append adds a gzip member; readers see one continuous stream
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def lookup(self, request):
+        """Return the recorded entry for a request, cycling through repeats in recording order."""
+        key = fingerprint(request)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMiss(f"No recorded response for {request.get('model')} request {key[:12]} in {self.path}")
+            index = self._plays.get(key, 0)
+            self._plays[key] = index + 1
+            return entries[index % len(entries)]
+
+    def wrap(self, client):
+        """Wrap a synchronous OpenAI client for recording or replay."""
+        create = self._record_sync(client) if self.mode == "record" else self._replay_sync
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    def wrap_async(self, client):
+        """Wrap an AsyncOpenAI client for recording or replay."""
+        create = self._record_async(client) if self.mode == "record" else self._replay_async
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    def _record_sync(self, client):
+        def create(**request):
+            start = time.perf_counter()
+            response = client.chat.completions.create(**request)
+            if not request.get("stream"):
+                self.record(request, {"response": response.model_dump(), "elapsed": time.perf_counter() - start})
+                return response
+            return self._record_stream_sync(request, response, start)
+        return create
+
+    def _record_stream_sync(self, request, stream, start):
+        chunks, offsets = [], []
+        for chunk in stream:
+            chunks.append(chunk.model_dump())
+            offsets.append(time.perf_counter() - start)
+            yield chunk
+        self.record(request, {"chunks": chunks, "offsets": offsets, "elapsed": time.perf_counter() - start})
+
+    def _record_async(self, client):
+        async def create(**request):
+            start = time.perf_counter()
+            response = await client.chat.completions.create(**request)
+            if not request.get("stream"):
+                self.record(request, {"response": response.model_dump(), "elapsed": time.perf_counter() - start})
+                return response
+            return self._record_stream_async(request, response, start)
+        return create
+
+    async def _record_stream_async(self, request, stream, start):
+        chunks, offsets = [], []
+        async for chunk in stream:
+            chunks.append(chunk.model_dump())
+            offsets.append(time.perf_counter() - start)
+            yield chunk
+        self.record(request, {"chunks": chunks, "offsets": offsets, "elapsed": time.perf_counter() - start})
+
+    def _replay_sync(self, **request):
+        from openai.types.chat import ChatCompletion, ChatCompletionChunk
+        entry = self.lookup(request)
+        start = time.perf_counter()
+        if "response" in entry:
+            self._sleep_until(start, entry["elapsed"])
+            return ChatCompletion.model_validate(entry["response"])
+
+        def stream():
+            for chunk, offset in zip(entry["chunks"], entry["offsets"]):
+                self._sleep_until(start, offset)
+                yield ChatCompletionChunk.model_validate(chunk)
+        return stream()
+
+    async def _replay_async(self, **request):
+        from openai.types.chat import ChatCompletion, ChatCompletionChunk
+        entry = self.lookup(request)
+        start = time.perf_counter()
+        if "response" in entry:
+            await asyncio.sleep(self._delay(start, entry["elapsed"]))
+            return ChatCompletion.model_validate(entry["response"])
+
+        async def stream():
+            for chunk, offset in zip(entry["chunks"], entry["offsets"]):
+                await asyncio.sleep(self._delay(start, offset))
+                yield ChatCompletionChunk.model_validate(chunk)
+        return stream()
+
+    def _delay(self, start, offset):
+        """Seconds to wait so an event lands at its (scaled) recorded offset."""
+        if not self.latency_scale:
+            return 0
+        return max(offset * self.latency_scale - (time.perf_counter() - start), 0)
+
+    def _sleep_until(self, start, offset):
+        delay = self._delay(start, offset)
+        if delay:
+            time.sleep(delay)
+
+
+def load_entries(path):
+    """Read all entries of a cassette file."""
+    entries = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entries.append(json.loads(line))
+    return entries
+
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette():
+    """Return the process-wide cassette configured by LLM_CASSETTE and LLM_CASSETTE_MODE, or None."""
+    global _cassette
+    path = os.getenv("LLM_CASSETTE")
+    mode = os.getenv("LLM_CASSETTE_MODE")
+    if not path or not mode:
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(path, mode, latency_scale=float(os.getenv("LLM_CASSETTE_LATENCY", "0")))
+        return _cassette
+
+
+def main(argv=None):
+    """Summarize a cassette file."""
+    parser = argparse.ArgumentParser(description="Inspect a recorded LLM cassette.")
+    parser.add_argument("cassette")
+    args = parser.parse_args(argv)
+
+    entries = load_entries(args.cassette)
+    tokens = {"prompt_tokens": 0, "completion_tokens": 0}
+    for entry in entries:
+        usage = (entry.get("response") or {}).get("usage") or next(
+            (c["usage"] for c in entry.get("chunks", []) if c.get("usage")), None
+        )
+        for key in tokens:
+            tokens[key] += (usage or {}).get(key) or 0
+    print(f"{len(entries)} calls ({len({e['fingerprint'] for e in entries})} distinct), "
+          f"{sum(e['elapsed'] for e in entries):.1f}s recorded, "
+          f"{tokens['prompt_tokens']} prompt / {tokens['completion_tokens']} completion tokens")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
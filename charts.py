@@ -0,0 +1,237 @@
+import io
+import re
+import base64
+import functools
+
+import numpy as np
+import matplotlib
+from matplotlib.figure import Figure
+
+from tracing import get_tracer
+
+# Rendered chart blocks kept in memory, one per distinct financials text
+CHART_CACHE_SIZE = 128
+
+# Keep text as SVG text instead of glyph paths, which makes files several times smaller.
+# Set once here: rcParams are process-global, and savefig reads this at render time.
+matplotlib.rcParams["svg.fonttype"] = "none"
+
+# (metric, label pattern, value kind) - the first matching label wins
+METRIC_LABELS = [
+    ("ebitda_margin", r"ebitda margin", "pct"),
+    ("ebitda", r"^(adjusted )?ebitda$", "amount"),
+    ("revenue", r"^(total |net )?(revenue|sales)$", "amount"),
+    ("arr", r"^arr$", "amount"),
+    ("gross_margin", r"gross margin", "pct"),
+    ("growth", r"growth", "pct"),
+    ("rd_pct", r"^r&d|research", "pct"),
+    ("sga_pct", r"^sg&a", "pct"),
+    ("cac_payback", r"payback", "amount"),
+    ("cac", r"customer acquisition cost|^cac$", "amount"),
+    ("ltv", r"^ltv|lifetime value", "amount"),
+    ("churn", r"churn", "pct"),
+]
+
+_PAIR = re.compile(r"([A-Za-z][A-Za-z&/'\- ]*?)\s*:\s*(.+?)(?=,\s*[A-Za-z][A-Za-z&/'\- ]*:|[;\n]|$)")
+_PERCENT = re.compile(r"(\(\s*)?(-?\d+(?:\.\d+)?)\s*%(\s*\))?")
+# A sign may sit before or after the currency symbol; "($6M)" is an accounting-style negative
+_AMOUNT = re.compile(
+    r"(?P<open>\(\s*)?(?P<sign>-\s*)?(?P<currency>[$€£]\s*)?(?P<inner_sign>-\s*)?"
+    r"(?<![\w.])(?P<number>\d[\d,]*(?:\.\d+)?)\s*(?P<scale>[kKmMbB])?(?![\w%])(?P<close>\s*\))?"
+)
+_YEAR = re.compile(r"(19|20)\d\d")
+_SCALE = {"k": 1e3, "m": 1e6, "b": 1e9}
+
+# Colors shared by all figures
+TOTAL_COLOR = "#4a6fa5"
+COST_COLOR = "#c8553d"
+
+
+def parse_financials(text):
+    """Extract known metrics from "Label: value, ..." financials text as {metric: float}."""
+    metrics = {}
+    for label, value in _PAIR.findall(text or ""):
+        label = " ".join(label.lower().split())
+        for metric, pattern, kind in METRIC_LABELS:
+            if metric in metrics or not re.search(pattern, label):
+                continue
+            parsed = _parse_value(value, kind)
+            if parsed is not None:
+                metrics[metric] = parsed
+            # "EBITDA: $5M (20% margin)" also states the margin
+            if metric == "ebitda":
+                margin = re.search(r"(-?\d+(?:\.\d+)?)\s*%\s*margin", value)
+                if margin and "ebitda_margin" not in metrics:
+                    metrics["ebitda_margin"] = float(margin.group(1))
+            break
+
+    # Fill in margins implied by absolute figures
+    if "ebitda_margin" not in metrics and metrics.get("revenue") and "ebitda" in metrics:
+        metrics["ebitda_margin"] = 100.0 * metrics["ebitda"] / metrics["revenue"]
+    return metrics
+
+
+def _parse_value(value, kind):
+    """Parse a percentage, or an amount with an optional K/M/B suffix."""
+    if kind == "pct":
+        match = _PERCENT.search(value)
+        if not match:
+            return None
+        number = float(match.group(2))
+        return -abs(number) if match.group(1) and match.group(3) else number
+    matches = list(_AMOUNT.finditer(value))
+    if not matches:
+        return None
+    # Prefer an explicit amount over a bare year, as in "Revenue: 2024 $25M"
+    match = next((m for m in matches if m.group("currency") or m.group("scale")), None) or \
+        next((m for m in matches if not _YEAR.fullmatch(m.group("number"))), matches[0])
+    number = float(match.group("number").replace(",", ""))
+    number *= _SCALE.get((match.group("scale") or "").lower(), 1.0)
+    if match.group("sign") or match.group("inner_sign") or (match.group("open") and match.group("close")):
+        number = -number
+    return number
+
+
+def margin_bridge(metrics):
+    """Waterfall from revenue through cost layers to EBITDA, in $M (or % of revenue if revenue is unknown)."""
+    if "ebitda_margin" not in metrics:
+        return None
+    scale = metrics["revenue"] / 1e6 if metrics.get("revenue") else 100.0
+    unit = "$M" if metrics.get("revenue") else "% of revenue"
+    ebitda_margin = metrics["ebitda_margin"] / 100
+
+    if "gross_margin" in metrics:
+        gross_margin = metrics["gross_margin"] / 100
+        opex_labels, opex = [], []
+        for metric, label in (("rd_pct", "R&D"), ("sga_pct", "SG&A")):
+            if metric in metrics:
+                opex_labels.append(label)
+                opex.append(metrics[metric] / 100)
+        other = gross_margin - ebitda_margin - sum(opex)
+        if other < 0:
+            # Stated cost lines do not reconcile; show operating costs as one step
+            opex_labels, opex = ["Operating costs"], [gross_margin - ebitda_margin]
+        elif opex:
+            opex_labels.append("Other opex")
+            opex.append(other)
+        else:
+            opex_labels, opex = ["Operating costs"], [other]
+        labels = ["Revenue", "COGS", "Gross profit"] + opex_labels + ["EBITDA"]
+        costs = np.array([1 - gross_margin] + opex) * scale
+        totals = np.array([1.0, gross_margin, ebitda_margin]) * scale
+        total_positions = np.array([0, 2, len(labels) - 1])
+        cost_positions = np.concatenate(([1], np.arange(3, len(labels) - 1)))
+    else:
+        labels = ["Revenue", "Operating costs", "EBITDA"]
+        costs = np.array([1 - ebitda_margin]) * scale
+        totals = np.array([1.0, ebitda_margin]) * scale
+        total_positions = np.array([0, 2])
+        cost_positions = np.array([1])
+
+    # Each cost step hangs from the running level left after the previous costs
+    levels_after = scale - np.cumsum(costs)
+
+    fig = Figure(figsize=(7, 3.6))
+    ax = fig.subplots()
+    ax.bar(total_positions, totals, color=TOTAL_COLOR)
+    ax.bar(cost_positions, costs, bottom=levels_after, color=COST_COLOR)
+    for x, height, bottom in zip(
+        np.concatenate((total_positions, cost_positions)),
+        np.concatenate((totals, -costs)),
+        np.concatenate((np.zeros_like(totals), levels_after + costs))
+    ):
+        ax.annotate(f"{height:,.1f}", (x, bottom + height if height > 0 else bottom),
+                    ha="center", va="bottom", fontsize=8, xytext=(0, 2), textcoords="offset points")
+    ax.set_xticks(np.arange(len(labels)), labels, fontsize=8)
+    ax.set_ylabel(unit)
+    ax.set_title("Margin bridge")
+    ax.spines[["top", "right"]].set_visible(False)
+    return fig
+
+
+def unit_economics(metrics):
+    """CAC against customer lifetime value, with the LTV/CAC ratio and payback."""
+    if "cac" not in metrics or "ltv" not in metrics:
+        return None
+    # Without a positive CAC and LTV there is no meaningful ratio or bar to draw
+    if metrics["cac"] <= 0 or metrics["ltv"] <= 0:
+        return None
+    values = np.array([metrics["cac"], metrics["ltv"]])
+    notes = [f"LTV/CAC {values[1] / values[0]:.1f}x"]
+    if "cac_payback" in metrics:
+        notes.append(f"CAC payback {metrics['cac_payback']:.0f} months")
+    if metrics.get("churn"):
+        notes.append(f"Implied customer lifetime {100 / metrics['churn']:.1f} years")
+
+    fig = Figure(figsize=(7, 2.6))
+    ax = fig.subplots()
+    ax.barh(np.arange(2), values, color=[COST_COLOR, TOTAL_COLOR])
+    for y, value in enumerate(values):
+        ax.annotate(f"${value:,.0f}", (value, y), va="center", fontsize=8, xytext=(3, 0), textcoords="offset points")
+    ax.set_yticks(np.arange(2), ["CAC", "LTV"])
+    ax.set_xlim(0, values.max() * 1.15)
+    ax.set_title("Unit economics - " + ", ".join(notes), fontsize=10)
+    ax.spines[["top", "right"]].set_visible(False)
+    return fig
+
+
+def sensitivity_heatmap(metrics):
+    """Next-year EBITDA in $M across revenue growth and EBITDA margin scenarios."""
+    if not metrics.get("revenue") or "ebitda_margin" not in metrics:
+        return None
+    growth = metrics.get("growth", 0.0) + np.array([-10.0, -5.0, 0.0, 5.0, 10.0])
+    margin = metrics["ebitda_margin"] + np.array([-5.0, -2.5, 0.0, 2.5, 5.0])
+    ebitda = metrics["revenue"] / 1e6 * (1 + growth[:, None] / 100) * (margin[None, :] / 100)
+
+    fig = Figure(figsize=(7, 3.8))
+    ax = fig.subplots()
+    image = ax.imshow(ebitda, cmap="RdYlGn", aspect="auto")
+    for (row, col), value in np.ndenumerate(ebitda):
+        ax.text(col, row, f"{value:,.1f}", ha="center", va="center", fontsize=8)
+    ax.set_xticks(np.arange(len(margin)), [f"{m:.1f}%" for m in margin], fontsize=8)
+    ax.set_yticks(np.arange(len(growth)), [f"{g:+.0f}%" for g in growth], fontsize=8)
+    ax.set_xlabel("EBITDA margin")
+    ax.set_ylabel("Revenue growth")
+    ax.set_title("Next-year EBITDA sensitivity ($M)")
+    fig.colorbar(image, ax=ax)
+    return fig
+
+
+FIGURES = [
+    ("Margin bridge", margin_bridge),
+    ("Unit economics", unit_economics),
+    ("EBITDA sensitivity", sensitivity_heatmap),
+]
+
+
+def build_figures(metrics):
+    """Return [(title, Figure)] for every standard figure the metrics support."""
+    figures = []
+    for title, build in FIGURES:
+        fig = build(metrics)
+        if fig is not None:
+            figures.append((title, fig))
+    return figures
+
+
+def figure_to_data_uri(fig):
+    """Serialize a figure to an SVG data URI."""
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="svg", bbox_inches="tight")
+    return "data:image/svg+xml;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+@functools.lru_cache(maxsize=CHART_CACHE_SIZE)
+def get_charts_html(financials):
+    """Render the charts for a financials text once and return them as an embeddable HTML block."""
+    with get_tracer().span("charts.render", chars=len(financials)) as span:
+        figures = build_figures(parse_financials(financials))
+        span.set_attribute("figures", len(figures))
+        if not figures:
+            return ""
+        images = "".join(
+            f'<figure style="margin: 0 0 15px 0;"><img src="{figure_to_data_uri(fig)}" alt="{title}" '
+            f'style="max-width: 100%;"></figure>'
+            for title, fig in figures
+        )
+        return f'<div class="report-charts">{images}</div>'
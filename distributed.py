@@ -0,0 +1,457 @@
+import os
+import csv
+import sys
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import argparse
+import threading
+from tracing import get_tracer
+
+# Seconds a worker owns a task before another worker may take it over
+DEFAULT_LEASE_SECONDS = 120
+# Attempts per task before it is marked failed
+DEFAULT_MAX_ATTEMPTS = 3
+# Base delay before a failed task is retried; doubles with every attempt
+DEFAULT_RETRY_BACKOFF = 5.0
+# Seconds an idle worker waits before polling the queue again
+POLL_INTERVAL = 1.0
+# Seconds before a task waiting for another worker's industry content is offered again
+DEFER_DELAY = 2.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id TEXT PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    company_json TEXT NOT NULL,
+    topics_json TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    completed REAL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    report_id TEXT NOT NULL REFERENCES reports(id),
+    kind TEXT NOT NULL,
+    topic TEXT,
+    position INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    available_at REAL NOT NULL,
+    result TEXT,
+    error TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks(status, available_at);
+CREATE INDEX IF NOT EXISTS tasks_by_report ON tasks(report_id);
+CREATE INDEX IF NOT EXISTS reports_by_run ON reports(run_id);
+CREATE TABLE IF NOT EXISTS rate_events (ts REAL NOT NULL);
+"""
+
+
+class TaskQueue:
+    """
+    Durable section-level task queue in a SQLite file on a shared volume.
+    Workers lease tasks, extend the lease with heartbeats and write results back;
+    expired leases are picked up by other workers. Uses the default rollback journal
+    because WAL mode does not work on network file systems.
+    """
+
+    def __init__(self, path, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 retry_backoff=DEFAULT_RETRY_BACKOFF):
+        """Open (and if needed create) the queue database."""
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        # Autocommit mode; write transactions are opened explicitly with BEGIN IMMEDIATE
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        """Close the database connection."""
+        self.db.close()
+
+    def _transaction(self):
+        """Open a write transaction that holds the database lock until commit."""
+        return _ImmediateTransaction(self.db)
+
+    def submit(self, companies, topics, title="Comprehensive Financial Analysis"):
+        """Create one report per company, split into one task per topic; return the run id."""
+        run_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._transaction():
+            for company_data in companies:
+                report_id = uuid.uuid4().hex
+                self.db.execute(
+                    "INSERT INTO reports (id, run_id, title, company_json, topics_json, status, created) "
+                    "VALUES (?, ?, ?, ?, ?, 'running', ?)",
+                    (report_id, run_id, title, json.dumps(company_data), json.dumps(topics), now)
+                )
+                self.db.executemany(
+                    "INSERT INTO tasks (report_id, kind, topic, position, status, available_at, updated) "
+                    "VALUES (?, 'section', ?, ?, 'pending', ?, ?)",
+                    [(report_id, topic, position, now, now) for position, topic in enumerate(topics)]
+                )
+        return run_id
+
+    def lease(self, worker_id):
+        """Take the next available task for this worker, or return None when there is nothing to do."""
+        now = time.time()
+        with self._transaction():
+            # Tasks whose lease ran out on their last attempt are given up
+            for expired in self.db.execute(
+                "SELECT id, report_id FROM tasks WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts)
+            ).fetchall():
+                self.db.execute(
+                    "UPDATE tasks SET status = 'failed', error = COALESCE(error, 'lease expired'), "
+                    "lease_owner = NULL, updated = ? WHERE id = ?",
+                    (now, expired["id"])
+                )
+                self._after_task_finished(expired["report_id"], now)
+
+            # Conclusions first so started reports finish before new ones begin
+            row = self.db.execute(
+                "SELECT t.*, r.title, r.company_json, r.topics_json FROM tasks t JOIN reports r ON r.id = t.report_id "
+                "WHERE (t.status = 'pending' AND t.available_at <= ?) OR (t.status = 'leased' AND t.lease_expires < ?) "
+                "ORDER BY t.kind = 'conclusion' DESC, t.id LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self.db.execute(
+                "UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                "updated = ? WHERE id = ?",
+                (worker_id, now + self.lease_seconds, now, row["id"])
+            )
+        task = dict(row)
+        task["company_data"] = json.loads(task.pop("company_json"))
+        task["topics"] = json.loads(task.pop("topics_json"))
+        task["attempts"] += 1
+        return task
+
+    def heartbeat(self, task_id, worker_id):
+        """Extend a lease; returns False if the worker no longer owns the task."""
+        cursor = self.db.execute(
+            "UPDATE tasks SET lease_expires = ?, updated = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (time.time() + self.lease_seconds, time.time(), task_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, task_id, worker_id, result):
+        """Store a task's result; returns False if the lease was lost in the meantime."""
+        now = time.time()
+        with self._transaction():
+            cursor = self.db.execute(
+                "UPDATE tasks SET status = 'done', result = ?, error = NULL, lease_owner = NULL, updated = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                (result, now, task_id, worker_id)
+            )
+            if cursor.rowcount != 1:
+                return False
+            report_id = self.db.execute("SELECT report_id FROM tasks WHERE id = ?", (task_id,)).fetchone()[0]
+            self._after_task_finished(report_id, now)
+        return True
+
+    def fail(self, task_id, worker_id, error):
+        """Record a failed attempt, scheduling a retry with backoff until attempts run out."""
+        now = time.time()
+        with self._transaction():
+            row = self.db.execute(
+                "SELECT report_id, attempts FROM tasks WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                (task_id, worker_id)
+            ).fetchone()
+            if row is None:
+                return
+            if row["attempts"] >= self.max_attempts:
+                self.db.execute(
+                    "UPDATE tasks SET status = 'failed', error = ?, lease_owner = NULL, updated = ? WHERE id = ?",
+                    (error, now, task_id)
+                )
+                self._after_task_finished(row["report_id"], now)
+            else:
+                delay = self.retry_backoff * 2 ** (row["attempts"] - 1)
+                self.db.execute(
+                    "UPDATE tasks SET status = 'pending', error = ?, lease_owner = NULL, available_at = ?, "
+                    "updated = ? WHERE id = ?",
+                    (error, now + delay, now, task_id)
+                )
+
+    def defer(self, task_id, worker_id, delay):
+        """Hand a leased task back for later without using up an attempt; returns False if the lease was lost."""
+        now = time.time()
+        cursor = self.db.execute(
+            "UPDATE tasks SET status = 'pending', attempts = attempts - 1, lease_owner = NULL, available_at = ?, "
+            "updated = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (now + delay, now, task_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def _after_task_finished(self, report_id, now):
+        """Queue the conclusion once every section is settled, or close the report after the conclusion."""
+        counts = dict(self.db.execute(
+            "SELECT kind || ':' || status, COUNT(*) FROM tasks WHERE report_id = ? GROUP BY kind, status",
+            (report_id,)
+        ).fetchall())
+        sections_open = counts.get("section:pending", 0) + counts.get("section:leased", 0)
+        has_conclusion = any(key.startswith("conclusion:") for key in counts)
+        if sections_open == 0 and not has_conclusion:
+            self.db.execute(
+                "INSERT INTO tasks (report_id, kind, topic, position, status, available_at, updated) "
+                "VALUES (?, 'conclusion', NULL, -1, 'pending', ?, ?)",
+                (report_id, now, now)
+            )
+        elif counts.get("conclusion:done") or counts.get("conclusion:failed"):
+            self.db.execute(
+                "UPDATE reports SET status = 'ready', completed = ? WHERE id = ? AND status = 'running'",
+                (now, report_id)
+            )
+
+    def section_results(self, report_id):
+        """Return {topic: content} for a report in topic order, with error text for failed sections."""
+        sections = {}
+        for row in self.db.execute(
+            "SELECT topic, status, result, error FROM tasks WHERE report_id = ? AND kind = 'section' ORDER BY position",
+            (report_id,)
+        ):
+            if row["status"] == "done":
+                sections[row["topic"]] = row["result"]
+            else:
+                sections[row["topic"]] = f"Error generating content for {row['topic']}: {row['error']}"
+        return sections
+
+    def ready_reports(self, run_id):
+        """Return finished reports of a run with their section and conclusion content."""
+        reports = []
+        for row in self.db.execute(
+            "SELECT r.id, r.title, r.company_json, c.status AS conclusion_status, c.result AS conclusion, "
+            "c.error AS conclusion_error FROM reports r JOIN tasks c ON c.report_id = r.id AND c.kind = 'conclusion' "
+            "WHERE r.run_id = ? AND r.status = 'ready'",
+            (run_id,)
+        ).fetchall():
+            conclusion = row["conclusion"] if row["conclusion_status"] == "done" else \
+                f"Error generating conclusion: {row['conclusion_error']}"
+            reports.append({
+                "id": row["id"],
+                "title": row["title"],
+                "company_data": json.loads(row["company_json"]),
+                "sections": self.section_results(row["id"]),
+                "conclusion": conclusion,
+            })
+        return reports
+
+    def mark_collected(self, report_id):
+        """Record that a report has been written out."""
+        self.db.execute("UPDATE reports SET status = 'collected' WHERE id = ?", (report_id,))
+
+    def status(self, run_id=None):
+        """Summarize report and task states, optionally for a single run."""
+        where, params = ("WHERE r.run_id = ?", (run_id,)) if run_id else ("", ())
+        reports = dict(self.db.execute(
+            f"SELECT r.status, COUNT(*) FROM reports r {where} GROUP BY r.status", params
+        ).fetchall())
+        tasks = dict(self.db.execute(
+            f"SELECT t.status, COUNT(*) FROM tasks t JOIN reports r ON r.id = t.report_id {where} GROUP BY t.status",
+            params
+        ).fetchall())
+        return {"reports": reports, "tasks": tasks}
+
+    def acquire_rate_slot(self, max_per_minute):
+        """Block until a provider call fits under the rate limit shared by all workers."""
+        while True:
+            now = time.time()
+            with self._transaction():
+                self.db.execute("DELETE FROM rate_events WHERE ts < ?", (now - 60,))
+                count, oldest = self.db.execute("SELECT COUNT(*), MIN(ts) FROM rate_events").fetchone()
+                if count < max_per_minute:
+                    self.db.execute("INSERT INTO rate_events (ts) VALUES (?)", (now,))
+                    return
+            time.sleep(max(oldest + 60 - now, 0.05))
+
+
+class _ImmediateTransaction:
+    """Context manager for BEGIN IMMEDIATE ... COMMIT/ROLLBACK on an autocommit connection."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def _heartbeat_loop(queue_path, task_id, worker_id, lease_seconds, stop):
+    """Keep a lease alive while the task runs (own connection, since SQLite connections are per thread)."""
+    queue = TaskQueue(queue_path, lease_seconds=lease_seconds)
+    try:
+        while not stop.wait(lease_seconds / 3):
+            if not queue.heartbeat(task_id, worker_id):
+                return
+    finally:
+        queue.close()
+
+
+def run_worker(queue_path, worker_id, model, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+               max_per_minute=None, exit_when_idle=False):
+    """Lease and execute tasks until stopped (or until the queue is empty with exit_when_idle)."""
+    from finance_agent import FinanceAgent
+    from industry_cache import IndustryCacheBusy
+
+    agent = FinanceAgent(model=model)
+    queue = TaskQueue(queue_path, lease_seconds=lease_seconds, max_attempts=max_attempts)
+    if max_per_minute:
+        # One slot per provider call; a section built on industry content may make two
+        agent.before_call = lambda: queue.acquire_rate_slot(max_per_minute)
+    processed = 0
+    try:
+        while True:
+            task = queue.lease(worker_id)
+            if task is None:
+                tasks = queue.status()["tasks"]
+                if exit_when_idle and not tasks.get("leased") and not tasks.get("pending"):
+                    return processed
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            stop = threading.Event()
+            heartbeat = threading.Thread(
+                target=_heartbeat_loop,
+                args=(queue_path, task["id"], worker_id, lease_seconds, stop),
+                daemon=True
+            )
+            heartbeat.start()
+            try:
+                with get_tracer().span("worker.task", kind=task["kind"], topic=task["topic"],
+                                       company=task["company_data"].get("name"), attempt=task["attempts"]):
+                    if task["kind"] == "section":
+                        result = agent.generate_section(task["topic"], task["company_data"], wait_for_industry=False)
+                    else:
+                        result = agent.generate_conclusion(task["company_data"], queue.section_results(task["report_id"]))
+                queue.complete(task["id"], worker_id, result)
+            except IndustryCacheBusy:
+                # Another worker is generating the industry content; do other tasks meanwhile
+                queue.defer(task["id"], worker_id, DEFER_DELAY)
+                continue
+            except Exception as e:
+                queue.fail(task["id"], worker_id, f"{type(e).__name__}: {e}")
+            finally:
+                stop.set()
+                heartbeat.join()
+            processed += 1
+    finally:
+        queue.close()
+
+
+def collect_reports(queue_path, run_id, out_dir, model):
+    """Assemble finished reports of a run into markdown files; returns the paths written."""
+    from finance_agent import FinanceAgent
+
+    agent = FinanceAgent(model=model)
+    queue = TaskQueue(queue_path)
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    try:
+        for report in queue.ready_reports(run_id):
+            content = agent.assemble_report(report["title"], report["company_data"], report["sections"],
+                                            report["conclusion"])
+            name = report["company_data"]["name"].replace(" ", "_").lower()
+            path = os.path.join(out_dir, f"financial_analysis_{name}_{report['id'][:8]}.md")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+            queue.mark_collected(report["id"])
+            written.append(path)
+    finally:
+        queue.close()
+    return written
+
+
+def load_portfolio(path):
+    """Read companies from a CSV file with name, industry and financials columns."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return [
+            {"name": row["name"], "industry": row["industry"], "financials": row["financials"]}
+            for row in csv.DictReader(f)
+        ]
+
+
+def main(argv=None):
+    """Coordinator and worker command line."""
+    parser = argparse.ArgumentParser(description="Distribute portfolio report generation across workers.")
+    parser.add_argument("--db", default=os.getenv("FINANCE_QUEUE_DB", "report_queue.sqlite"),
+                        help="Queue database on a volume shared by all hosts")
+    parser.add_argument("--model", default=os.getenv("OPENAI_MODEL", "gpt-4o"))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="Split a portfolio into section tasks")
+    submit.add_argument("portfolio", help="CSV with name, industry, financials columns")
+    submit.add_argument("--topics", required=True, help="Comma-separated report topics")
+    submit.add_argument("--title", default="Comprehensive Financial Analysis")
+
+    worker = commands.add_parser("worker", help="Lease and run tasks")
+    worker.add_argument("--concurrency", type=int, default=4, help="Worker threads in this process")
+    worker.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS)
+    worker.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+    worker.add_argument("--max-rpm", type=int, help="Provider requests per minute shared by all workers")
+    worker.add_argument("--exit-when-idle", action="store_true", help="Stop once the queue is drained")
+
+    status = commands.add_parser("status", help="Show report and task counts")
+    status.add_argument("--run", help="Only this run")
+
+    collect = commands.add_parser("collect", help="Assemble finished reports into markdown files")
+    collect.add_argument("--run", required=True)
+    collect.add_argument("--out", default="reports")
+    collect.add_argument("--wait", action="store_true", help="Keep collecting until every report is done")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "submit":
+        companies = load_portfolio(args.portfolio)
+        topics = [t.strip() for t in args.topics.split(",") if t.strip()]
+        queue = TaskQueue(args.db)
+        run_id = queue.submit(companies, topics, args.title)
+        queue.close()
+        print(f"Run {run_id}: {len(companies)} reports, {len(companies) * len(topics)} section tasks")
+    elif args.command == "worker":
+        host = socket.gethostname()
+        threads = [
+            threading.Thread(
+                target=run_worker,
+                args=(args.db, f"{host}:{os.getpid()}:{i}", args.model, args.lease_seconds, args.max_attempts,
+                      args.max_rpm, args.exit_when_idle)
+            )
+            for i in range(args.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elif args.command == "status":
+        queue = TaskQueue(args.db)
+        print(json.dumps(queue.status(args.run), indent=2))
+        queue.close()
+    elif args.command == "collect":
+        while True:
+            for path in collect_reports(args.db, args.run, args.out, args.model):
+                print(f"Wrote {path}")
+            queue = TaskQueue(args.db)
+            remaining = queue.status(args.run)["reports"].get("running", 0)
+            queue.close()
+            if not args.wait or remaining == 0:
+                break
+            time.sleep(POLL_INTERVAL * 5)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
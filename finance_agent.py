@@ -2,6 +2,9 @@ import os
 import openai
 import json
 from dotenv import load_dotenv
+from tracing import get_tracer, current_span, record_usage
+from cassette import get_cassette
+from industry_cache import get_industry_cache, INDUSTRY_SECTIONS
 
 # Load environment variables
 load_dotenv()
@@ -16,10 +19,24 @@ except ImportError:
 # First check .env file
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+# Replaying a recorded cassette needs no real API key
+if not openai.api_key and os.getenv("LLM_CASSETTE_MODE") == "replay":
+    openai.api_key = "cassette-replay"
+
 # If not found in .env, check Streamlit secrets if available
 if not openai.api_key and has_streamlit and hasattr(st, "secrets"):
-    if "OPENAI_API_KEY" in st.secrets:
-        openai.api_key = st.secrets["OPENAI_API_KEY"]
+    try:
+        if "OPENAI_API_KEY" in st.secrets:
+            openai.api_key = st.secrets["OPENAI_API_KEY"]
+    except FileNotFoundError:
+        # No secrets.toml, e.g. when imported by the headless API
+        pass
+
+# Local tokenizer for pre-flight estimates; without it tokens are estimated as characters / 4
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
 # Check OpenAI version and set appropriate client
 try:
@@ -28,11 +45,25 @@ try:
     USING_NEW_OPENAI = int(__version__.split('.')[0]) >= 1
     if USING_NEW_OPENAI:
         # For OpenAI v1.x.x, create a client instance
-        from openai import OpenAI
+        from openai import OpenAI, AsyncOpenAI
         client = OpenAI(api_key=openai.api_key)
+        # Async client for the HTTP API, which streams many reports from one event loop
+        async_client = AsyncOpenAI(api_key=openai.api_key)
 except:
     USING_NEW_OPENAI = False
 
+# Output budget for the company-specific part of a section built on cached industry content
+INDUSTRY_DELTA_MAX_TOKENS = 800
+
+# Typical completion sizes and model speed used by estimate_report before any call is made
+ESTIMATED_SECTION_TOKENS = int(os.getenv("ESTIMATED_SECTION_TOKENS", "900"))
+ESTIMATED_DELTA_TOKENS = int(os.getenv("ESTIMATED_DELTA_TOKENS", "350"))
+ESTIMATED_CONCLUSION_TOKENS = int(os.getenv("ESTIMATED_CONCLUSION_TOKENS", "450"))
+ESTIMATED_FIRST_TOKEN_SECONDS = float(os.getenv("ESTIMATED_FIRST_TOKEN_SECONDS", "1.0"))
+ESTIMATED_TOKENS_PER_SECOND = float(os.getenv("ESTIMATED_TOKENS_PER_SECOND", "50"))
+# Chat format overhead per request (message framing for a system and a user message)
+MESSAGE_OVERHEAD_TOKENS = 7
+
 class FinanceAgent:
     """
     An agentic AI assistant for finance and private equity tasks.
@@ -42,23 +73,41 @@ class FinanceAgent:
     def __init__(self, model="gpt-4o"):
         """Initialize the finance agent with the specified model."""
         self.model = model
+        # Shared industry-level sections, enabled with INDUSTRY_CACHE_DB
+        self.industry_cache = get_industry_cache()
+        self._encoder = None
+        # Optional callable run before every synchronous model call, e.g. to share a rate limit
+        self.before_call = None
         # Store OpenAI client if using new version
         if USING_NEW_OPENAI:
             self.client = client
+            self.async_client = async_client
+            # Record or replay chat.completions.create calls (LLM_CASSETTE, LLM_CASSETTE_MODE)
+            cassette = get_cassette()
+            if cassette is not None:
+                self.client = cassette.wrap(self.client)
+                self.async_client = cassette.wrap_async(self.async_client)
     
-    def generate_financial_report(self, report_title, company_data, format_type, selected_reports):
-        """Generate a financial report based on selected report types and details."""
-        # Initialize the report content
-        report_content = f"# {report_title}\n\n"
-        
-        # Add company information section
-        report_content += f"""## Company Information
-
-**Company:** {company_data['name']}  
-**Industry:** {company_data['industry']}  
-**Financial Overview:** {company_data['financials']}
+    def generate_financial_report(self, report_title, company_data, format_type, selected_reports, precomputed_sections=None):
+        """
+        Generate a financial report based on selected report types and details.
+        Sections found in precomputed_sections ({section: content}) are used as they are.
+        """
+        precomputed_sections = precomputed_sections or {}
+        with get_tracer().span(
+            "agent.generate_financial_report",
+            company=company_data.get('name'),
+            industry=company_data.get('industry'),
+            model=self.model,
+            sections=sum(len(details) for details in selected_reports.values()),
+            precomputed=len(precomputed_sections)
+        ):
+            return self._generate_report(report_title, company_data, format_type, selected_reports, precomputed_sections)
 
-"""
+    def _generate_report(self, report_title, company_data, format_type, selected_reports, precomputed_sections):
+        """Build the report section by section; wrapped in a trace span by generate_financial_report."""
+        # Initialize the report content with the company information section
+        report_content = self._report_header(report_title, company_data)
         
         # Calculate total sections for progress tracking
         total_sections = sum(len(details) for details in selected_reports.values())
@@ -91,13 +140,17 @@ class FinanceAgent:
                 # Add each detail as a section in the report with a horizontal rule
                 report_content += f"---\n\n### {detail}\n"
                 
-                # Generate content with awareness of previous sections
-                section_content = self._generate_section_content(
-                    detail, 
-                    company_data, 
-                    generated_sections,
-                    previous_content
-                )
+                if detail in precomputed_sections:
+                    # Already generated ahead of the request
+                    section_content = precomputed_sections[detail]
+                else:
+                    # Generate content with awareness of previous sections
+                    section_content = self._generate_section_content(
+                        detail, 
+                        company_data, 
+                        generated_sections,
+                        previous_content
+                    )
                 
                 # Store this section's content for future reference
                 generated_sections[detail] = section_content
@@ -126,8 +179,239 @@ class FinanceAgent:
             # Implement other formats if needed
             return report_content
 
+    def _report_header(self, report_title, company_data):
+        """Build the report title and company information section."""
+        return f"""# {report_title}
+
+## Company Information
+
+**Company:** {company_data['name']}  
+**Industry:** {company_data['industry']}  
+**Financial Overview:** {company_data['financials']}
+
+"""
+
+    async def stream_financial_report(self, report_title, company_data, selected_reports):
+        """
+        Generate a report on the async client, yielding (event, data) pairs as it goes.
+        Events are section_started, token, section_completed, conclusion_started and
+        finally report with the full markdown, which matches generate_financial_report.
+        """
+        if not USING_NEW_OPENAI:
+            raise RuntimeError("Streaming reports require openai>=1.0")
+        
+        details = [detail for details in selected_reports.values() for detail in details]
+        with get_tracer().span(
+            "agent.stream_financial_report",
+            company=company_data.get('name'),
+            industry=company_data.get('industry'),
+            model=self.model,
+            sections=len(details)
+        ):
+            report_content = self._report_header(report_title, company_data)
+            generated_sections = {}
+            previous_content = ""
+            
+            for index, detail in enumerate(details, start=1):
+                yield "section_started", {"section": detail, "index": index, "total": len(details)}
+                
+                parts = []
+                try:
+                    with get_tracer().span("agent.section", topic=detail, model=self.model):
+                        if self._uses_industry_base(detail):
+                            # Cached industry content first, then only the company-specific part is streamed
+                            base = await self.industry_base_async(detail, company_data['industry'])
+                            parts.append(self._industry_section_prefix(base, company_data))
+                            yield "token", {"section": detail, "text": parts[0]}
+                            system_prompt, user_prompt = self._delta_prompts(detail, company_data, base, previous_content)
+                            max_tokens = INDUSTRY_DELTA_MAX_TOKENS
+                        else:
+                            system_prompt, user_prompt = self._section_prompts(detail, company_data, previous_content)
+                            max_tokens = 10000
+                        async for delta in self._stream_complete(system_prompt, user_prompt, max_tokens=max_tokens):
+                            parts.append(delta)
+                            yield "token", {"section": detail, "text": delta}
+                    section_content = "".join(parts)
+                except Exception as e:
+                    section_content = f"Error generating content for {detail}: {str(e)}"
+                
+                # Same bookkeeping as the synchronous path
+                generated_sections[detail] = section_content
+                previous_content += f"\n\n{detail}:\n{section_content}"
+                report_content += f"---\n\n### {detail}\n{section_content}\n\n"
+                yield "section_completed", {
+                    "section": detail,
+                    "index": index,
+                    "total": len(details),
+                    "progress": index / (len(details) + 1)
+                }
+            
+            yield "conclusion_started", {}
+            system_prompt, user_prompt = self._conclusion_prompts(company_data, generated_sections)
+            parts = []
+            try:
+                with get_tracer().span("agent.conclusion", model=self.model, sections=len(generated_sections)):
+                    async for delta in self._stream_complete(system_prompt, user_prompt, max_tokens=1000):
+                        parts.append(delta)
+                        yield "token", {"section": "Conclusion", "text": delta}
+                conclusion_content = "".join(parts)
+            except Exception as e:
+                conclusion_content = f"Error generating conclusion: {str(e)}"
+            
+            report_content += f"---\n\n## Conclusion\n\n{conclusion_content}"
+            yield "report", {"content": report_content}
+
+    def estimate_report(self, company_data, selected_reports):
+        """
+        Predict prompt and completion tokens and the expected duration of a report before any call is made.
+        Prompts are built exactly as generation would build them and counted with the local tokenizer;
+        completion sizes and model speed are typical values (ESTIMATED_* environment variables).
+        """
+        details = [detail for details in selected_reports.values() for detail in details]
+        with get_tracer().span("agent.estimate", model=self.model, sections=len(details)) as span:
+            prompt_tokens = completion_tokens = calls = 0
+            previous_tokens = 0
+            for detail in details:
+                # The previous-sections block is counted separately from its (not yet known) content
+                previous_content = " " if previous_tokens else ""
+                if self._uses_industry_base(detail):
+                    base = self.industry_cache.peek(company_data['industry'], detail, self.model)
+                    if base is None:
+                        prompt_tokens += self._count_prompt(*self._industry_prompts(detail, company_data['industry']))
+                        completion_tokens += ESTIMATED_SECTION_TOKENS
+                        calls += 1
+                        base_tokens = ESTIMATED_SECTION_TOKENS
+                    else:
+                        base_tokens = self.count_tokens(base)
+                    prompt_tokens += self._count_prompt(*self._delta_prompts(detail, company_data, "", previous_content))
+                    prompt_tokens += base_tokens + previous_tokens
+                    completion_tokens += ESTIMATED_DELTA_TOKENS
+                    section_tokens = base_tokens + ESTIMATED_DELTA_TOKENS
+                else:
+                    prompt_tokens += self._count_prompt(*self._section_prompts(detail, company_data, previous_content))
+                    prompt_tokens += previous_tokens
+                    completion_tokens += ESTIMATED_SECTION_TOKENS
+                    section_tokens = ESTIMATED_SECTION_TOKENS
+                calls += 1
+                previous_tokens += section_tokens + self.count_tokens(f"\n\n{detail}:\n")
+            
+            # The conclusion sees a 200 character excerpt of every section
+            excerpts = {detail: "x" * 203 for detail in details}
+            prompt_tokens += self._count_prompt(*self._conclusion_prompts(company_data, excerpts))
+            completion_tokens += ESTIMATED_CONCLUSION_TOKENS
+            calls += 1
+            
+            estimate = {
+                "sections": len(details),
+                "calls": calls,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                # Calls run one after another, each dominated by its output
+                "latency_seconds": calls * ESTIMATED_FIRST_TOKEN_SECONDS + completion_tokens / ESTIMATED_TOKENS_PER_SECOND,
+                "tokenizer": "tiktoken" if self._get_encoder() else "chars/4",
+            }
+            span.set_attributes(estimate)
+            return estimate
+
+    def count_tokens(self, text):
+        """Count tokens with the model's tokenizer, or estimate them as characters / 4."""
+        encoder = self._get_encoder()
+        if encoder:
+            return len(encoder.encode(text))
+        return (len(text) + 3) // 4
+
+    def _count_prompt(self, system_prompt, user_prompt):
+        return self.count_tokens(system_prompt) + self.count_tokens(user_prompt) + MESSAGE_OVERHEAD_TOKENS
+
+    def _get_encoder(self):
+        """Load the tiktoken encoding for the model once; False if tiktoken is unavailable."""
+        if self._encoder is None:
+            self._encoder = False
+            if tiktoken is not None:
+                try:
+                    try:
+                        self._encoder = tiktoken.encoding_for_model(self.model)
+                    except KeyError:
+                        self._encoder = tiktoken.get_encoding("o200k_base")
+                except Exception:
+                    # Encodings are downloaded on first use; stay on the estimate when offline
+                    self._encoder = False
+        return self._encoder
+
+    def assemble_report(self, report_title, company_data, sections, conclusion_content):
+        """Join separately generated sections and a conclusion in the format of generate_financial_report."""
+        report_content = self._report_header(report_title, company_data)
+        for detail, section_content in sections.items():
+            report_content += f"---\n\n### {detail}\n{section_content}\n\n"
+        report_content += f"---\n\n## Conclusion\n\n{conclusion_content}"
+        return report_content
+
+    def generate_section(self, detail, company_data, previous_content="", wait_for_industry=True):
+        """
+        Generate a single section, raising on API errors so callers can retry.
+        With wait_for_industry=False, IndustryCacheBusy is raised instead of waiting while
+        another process generates the industry content this section needs.
+        """
+        with get_tracer().span("agent.section", topic=detail, model=self.model):
+            if self._uses_industry_base(detail):
+                # Cached industry-level content plus a short company-specific delta call
+                base = self.industry_base(detail, company_data['industry'], wait=wait_for_industry)
+                system_prompt, user_prompt = self._delta_prompts(detail, company_data, base, previous_content)
+                delta = self._complete(system_prompt, user_prompt, max_tokens=INDUSTRY_DELTA_MAX_TOKENS)
+                return self._industry_section_prefix(base, company_data) + delta
+            system_prompt, user_prompt = self._section_prompts(detail, company_data, previous_content)
+            return self._complete(system_prompt, user_prompt, max_tokens=10000)
+
+    def industry_base(self, detail, industry, wait=True):
+        """Return the industry-level content for a section, generated once per industry and model."""
+        with get_tracer().span("agent.industry_base", topic=detail, industry=industry, model=self.model) as span:
+            content, cached = self.industry_cache.get_or_create(
+                industry,
+                detail,
+                self.model,
+                lambda: self._complete(*self._industry_prompts(detail, industry), max_tokens=10000),
+                wait=wait
+            )
+            span.set_attribute("cache_hit", cached)
+            return content
+
+    async def industry_base_async(self, detail, industry):
+        """industry_base for the async path: generates on the async client and waits without holding a thread."""
+        with get_tracer().span("agent.industry_base", topic=detail, industry=industry, model=self.model) as span:
+            async def generate():
+                return "".join([
+                    delta async for delta in
+                    self._stream_complete(*self._industry_prompts(detail, industry), max_tokens=10000)
+                ])
+
+            content, cached = await self.industry_cache.get_or_create_async(industry, detail, self.model, generate)
+            span.set_attribute("cache_hit", cached)
+            return content
+
+    def _uses_industry_base(self, detail):
+        """Whether a section is built from cached industry content."""
+        return self.industry_cache is not None and detail in INDUSTRY_SECTIONS
+
+    def _industry_section_prefix(self, base, company_data):
+        """Industry content followed by the lead-in for the company-specific part."""
+        return f"{base}\n\n**Implications for {company_data['name']}**\n\n"
+
+    def generate_conclusion(self, company_data, generated_sections):
+        """Generate the conclusion for already generated sections, raising on API errors."""
+        system_prompt, user_prompt = self._conclusion_prompts(company_data, generated_sections)
+        with get_tracer().span("agent.conclusion", model=self.model, sections=len(generated_sections)):
+            return self._complete(system_prompt, user_prompt, max_tokens=1000)
+
     def _generate_section_content(self, detail, company_data, generated_sections={}, previous_content=""):
         """Generate content for each section based on the detail and company data."""
+        try:
+            return self.generate_section(detail, company_data, previous_content)
+        except Exception as e:
+            return f"Error generating content for {detail}: {str(e)}"
+
+    def _section_prompts(self, detail, company_data, previous_content=""):
+        """Build the system and user prompts for a report section."""
         # Create a prompt for the OpenAI model with minimal styling requirements
         system_prompt = f"""
         You are a senior financial analyst with 15+ years of private equity experience.
@@ -192,38 +476,93 @@ class FinanceAgent:
         Do not include the section header in your response as it will be added separately.
         """
         
-        try:
-            if USING_NEW_OPENAI:
-                # New OpenAI API format (v1.0.0+)
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=10000
-                )
-                section_content = response.choices[0].message.content
-            else:
-                # Old OpenAI API format (pre-v1.0.0)
-                response = openai.Completion.create(
-                    engine=self.model,
-                    prompt=f"{system_prompt}\n\nUser: {user_prompt}\n\nAssistant:",
-                    temperature=0.7,
-                    max_tokens=10000,
-                    top_p=1.0,
-                    frequency_penalty=0.0,
-                    presence_penalty=0.0
-                )
-                section_content = response.choices[0].text.strip()
+        return system_prompt, user_prompt
+
+    def _industry_prompts(self, detail, industry):
+        """Build the prompts for the industry-level part of a section, shared by all companies in the industry."""
+        system_prompt = f"""
+        You are a senior financial analyst with 15+ years of private equity experience.
+        You are writing the "{detail}" section of financial reports on companies in the {industry} industry.
+        
+        This text will be reused in reports on many different companies in this industry, so it must
+        not refer to any specific company. Cover what holds for the industry as a whole.
+        
+        Your analysis must be thorough with quantitative precision:
+        - Market size, growth rates and key trends
+        - Industry benchmarks for margins, growth and valuation multiples
+        - Regulatory environment and legal risks typical for the industry
+        - Key success factors and structural risks
+        
+        Keep your analysis professional but with minimal formatting.
+        """
+        
+        user_prompt = f"""
+        Generate the industry-level "{detail}" section for the {industry} industry.
+        
+        Make sure your response:
+        1. Is focused ONLY on the "{detail}" section
+        2. Uses minimal markdown formatting
+        3. Provides specific numerical insights and industry benchmarks
+        4. Does not mention or assume any particular company
+        
+        Do not include the section header in your response as it will be added separately.
+        """
+        
+        return system_prompt, user_prompt
+
+    def _delta_prompts(self, detail, company_data, industry_content, previous_content=""):
+        """Build the prompts that adapt cached industry content to one company."""
+        system_prompt = f"""
+        You are a senior financial analyst with 15+ years of private equity experience.
+        The "{detail}" section of a financial report about {company_data['name']} already contains
+        an industry-level analysis of the {company_data['industry']} industry.
+        
+        Your task is to write a short company-specific addition: how the industry factors apply to
+        {company_data['name']} given its financials. Do not restate the industry analysis.
+        
+        Keep your analysis professional but with minimal formatting.
+        """
+        
+        user_prompt = f"""
+        Industry-level analysis already in the section:
+        
+        {industry_content}
+        
+        **Company:** {company_data.get('name', 'the company')}
+        **Industry:** {company_data.get('industry', 'the specified industry')}
+        **Financials:** {company_data.get('financials', 'the provided financial data')}
+        
+        Write 2-3 paragraphs that:
+        1. Compare the company's metrics with the industry benchmarks above
+        2. Quantify its exposure to the trends, risks and regulations described
+        3. Note where it is better or worse positioned than a typical industry peer
+        """
+        
+        # If there are previous sections, include them as context
+        if previous_content:
+            user_prompt += f"""
             
-            return section_content
-        except Exception as e:
-            return f"Error generating content for {detail}: {str(e)}"
+            Here is information that has already been covered in previous sections, DO NOT REPEAT this information:
+            
+            {previous_content}
+            """
+        
+        user_prompt += """
+        
+        Do not include a header in your response.
+        """
+        
+        return system_prompt, user_prompt
 
     def _generate_conclusion(self, company_data, generated_sections):
         """Generate a conclusion that summarizes the key points from all sections."""
+        try:
+            return self.generate_conclusion(company_data, generated_sections)
+        except Exception as e:
+            return f"Error generating conclusion: {str(e)}"
+
+    def _conclusion_prompts(self, company_data, generated_sections):
+        """Build the system and user prompts for the conclusion."""
         system_prompt = f"""
         You are a senior financial analyst with 15+ years of private equity experience.
         You are creating the conclusion section for a financial report about {company_data['name']}, a company in the {company_data['industry']} industry.
@@ -262,32 +601,61 @@ class FinanceAgent:
         Do not add a conclusion header as it will be added separately.
         """
         
-        try:
-            if USING_NEW_OPENAI:
-                # New OpenAI API format (v1.0.0+)
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=1000
-                )
-                conclusion_content = response.choices[0].message.content
-            else:
-                # Old OpenAI API format (pre-v1.0.0)
-                response = openai.Completion.create(
-                    engine=self.model,
-                    prompt=f"{system_prompt}\n\nUser: {user_prompt}\n\nAssistant:",
-                    temperature=0.7,
-                    max_tokens=1000,
-                    top_p=1.0,
-                    frequency_penalty=0.0,
-                    presence_penalty=0.0
-                )
-                conclusion_content = response.choices[0].text.strip()
-            
-            return conclusion_content
-        except Exception as e:
-            return f"Error generating conclusion: {str(e)}"
+        return system_prompt, user_prompt
+
+    def _complete(self, system_prompt, user_prompt, max_tokens):
+        """Send a system/user prompt pair to the model and return the generated text."""
+        if self.before_call is not None:
+            self.before_call()
+        if USING_NEW_OPENAI:
+            # New OpenAI API format (v1.0.0+)
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                temperature=0.7,
+                max_tokens=max_tokens
+            )
+            content = response.choices[0].message.content
+        else:
+            # Old OpenAI API format (pre-v1.0.0)
+            response = openai.Completion.create(
+                engine=self.model,
+                prompt=f"{system_prompt}\n\nUser: {user_prompt}\n\nAssistant:",
+                temperature=0.7,
+                max_tokens=max_tokens,
+                top_p=1.0,
+                frequency_penalty=0.0,
+                presence_penalty=0.0
+            )
+            content = response.choices[0].text.strip()
+        
+        # Attach token usage to the enclosing section/conclusion span
+        span = current_span()
+        if span is not None:
+            record_usage(span, response)
+        return content
+
+    async def _stream_complete(self, system_prompt, user_prompt, max_tokens):
+        """Stream the model's answer to a system/user prompt pair, yielding text deltas."""
+        stream = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.7,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            # The final chunk carries usage and no choices
+            if chunk.usage is not None:
+                span = current_span()
+                if span is not None:
+                    record_usage(span, chunk)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
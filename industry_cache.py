@@ -0,0 +1,229 @@
+import os
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+
+# Sections whose content depends mostly on the industry rather than the company
+INDUSTRY_SECTIONS = ["Industry Analysis", "Legal & Regulatory Considerations"]
+# Seconds a generator owns an entry before a waiting process may take over
+DEFAULT_LOCK_SECONDS = 300
+# Seconds between checks while another process generates the same entry
+POLL_INTERVAL = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS industry_sections (
+    industry TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    model TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (industry, topic, model)
+);
+CREATE TABLE IF NOT EXISTS industry_locks (
+    industry TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    model TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (industry, topic, model)
+);
+"""
+
+
+class IndustryCacheBusy(Exception):
+    """Raised by get_or_create(wait=False) while another caller generates the entry."""
+
+
+def normalize_industry(industry):
+    """Cache key form of an industry name, so "Software  & Technology " matches "software & technology"."""
+    return " ".join(industry.lower().split())
+
+
+class IndustryCache:
+    """
+    Industry-level section content shared across reports, keyed by (industry, topic, model).
+    Entries are regenerated once older than `ttl` seconds. Generation is single-flight:
+    concurrent requests for a missing entry, in any thread or process using the same file,
+    wait for the one generator instead of all calling the model.
+    """
+
+    def __init__(self, path, ttl, lock_seconds=DEFAULT_LOCK_SECONDS):
+        """Open (and if needed create) the cache database."""
+        self.path = path
+        self.ttl = ttl
+        self.lock_seconds = lock_seconds
+        db = self._connect()
+        try:
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    def _connect(self):
+        # One short-lived connection per call, since SQLite connections are per thread;
+        # autocommit mode with explicit BEGIN IMMEDIATE like the distributed queue
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def get_or_create(self, industry, topic, model, generate, wait=True):
+        """
+        Return (content, cached), calling generate() only if no fresh entry exists.
+        While another caller generates the entry this polls for it, or raises IndustryCacheBusy with wait=False.
+        """
+        key = (normalize_industry(industry), topic, model)
+        owner = uuid.uuid4().hex
+        while True:
+            state, content = self._claim(key, owner)
+            if state == "cached":
+                return content, True
+            if state == "acquired":
+                break
+            if not wait:
+                raise IndustryCacheBusy(f"{topic} for {industry} is being generated by another worker")
+            time.sleep(POLL_INTERVAL)
+
+        try:
+            content = generate()
+        except BaseException:
+            self._abandon(key, owner)
+            raise
+        self._store(key, owner, content)
+        return content, False
+
+    async def get_or_create_async(self, industry, topic, model, generate):
+        """
+        Like get_or_create for an event loop: generate is a coroutine function, and waiting for
+        another generator uses asyncio.sleep instead of holding a thread for the whole wait.
+        """
+        key = (normalize_industry(industry), topic, model)
+        owner = uuid.uuid4().hex
+        while True:
+            # Each step is one short transaction, but SQLite may still block on its busy timeout
+            state, content = await asyncio.to_thread(self._claim, key, owner)
+            if state == "cached":
+                return content, True
+            if state == "acquired":
+                break
+            await asyncio.sleep(POLL_INTERVAL)
+
+        try:
+            content = await generate()
+        except BaseException:
+            await asyncio.to_thread(self._abandon, key, owner)
+            raise
+        await asyncio.to_thread(self._store, key, owner, content)
+        return content, False
+
+    def _claim(self, key, owner):
+        """
+        Look up an entry and take the generator lock if it is missing or stale.
+        Returns ("cached", content), ("acquired", None) or ("busy", None) when another owner holds the lock.
+        """
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT content, created FROM industry_sections WHERE industry = ? AND topic = ? AND model = ?",
+                    key
+                ).fetchone()
+                if row is not None and now - row["created"] < self.ttl:
+                    db.execute(
+                        "UPDATE industry_sections SET hits = hits + 1 WHERE industry = ? AND topic = ? AND model = ?",
+                        key
+                    )
+                    db.execute("COMMIT")
+                    return "cached", row["content"]
+                lock = db.execute(
+                    "SELECT expires FROM industry_locks WHERE industry = ? AND topic = ? AND model = ?",
+                    key
+                ).fetchone()
+                acquired = lock is None or lock["expires"] < now
+                if acquired:
+                    db.execute(
+                        "INSERT OR REPLACE INTO industry_locks (industry, topic, model, owner, expires) VALUES (?, ?, ?, ?, ?)",
+                        key + (owner, now + self.lock_seconds)
+                    )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        finally:
+            db.close()
+        return ("acquired" if acquired else "busy"), None
+
+    def _store(self, key, owner, content):
+        """Save generated content and drop the generator lock."""
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "INSERT OR REPLACE INTO industry_sections (industry, topic, model, content, created) VALUES (?, ?, ?, ?, ?)",
+                key + (content, time.time())
+            )
+            db.execute(
+                "DELETE FROM industry_locks WHERE industry = ? AND topic = ? AND model = ? AND owner = ?",
+                key + (owner,)
+            )
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def _abandon(self, key, owner):
+        """Drop the generator lock after a failed generation so another caller can retry."""
+        db = self._connect()
+        try:
+            db.execute(
+                "DELETE FROM industry_locks WHERE industry = ? AND topic = ? AND model = ? AND owner = ?",
+                key + (owner,)
+            )
+        finally:
+            db.close()
+
+    def peek(self, industry, topic, model):
+        """Return the fresh cached content for an entry, or None, without generating it."""
+        db = self._connect()
+        try:
+            row = db.execute(
+                "SELECT content, created FROM industry_sections WHERE industry = ? AND topic = ? AND model = ?",
+                (normalize_industry(industry), topic, model)
+            ).fetchone()
+        finally:
+            db.close()
+        if row is None or time.time() - row["created"] >= self.ttl:
+            return None
+        return row["content"]
+
+    def stats(self):
+        """Return one row per cached entry with its age and reuse count."""
+        db = self._connect()
+        try:
+            now = time.time()
+            return [
+                {"industry": row["industry"], "topic": row["topic"], "model": row["model"],
+                 "age_hours": round((now - row["created"]) / 3600, 1), "hits": row["hits"],
+                 "fresh": now - row["created"] < self.ttl}
+                for row in db.execute("SELECT * FROM industry_sections ORDER BY industry, topic")
+            ]
+        finally:
+            db.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_industry_cache():
+    """Return the process-wide industry cache if INDUSTRY_CACHE_DB is set, else None."""
+    global _cache
+    path = os.getenv("INDUSTRY_CACHE_DB")
+    if not path:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = IndustryCache(path, ttl=float(os.getenv("INDUSTRY_CACHE_TTL_HOURS", "24")) * 3600)
+        return _cache
@@ -0,0 +1,451 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import threading
+import subprocess
+import urllib.request
+
+# Company inputs the virtual users type into the form
+LOAD_TEST_COMPANIES = [
+    ("TechNova Solutions", "Software & Technology",
+     "Revenue: $25M, EBITDA: $5M (20% margin), YoY Growth: 35%, Gross Margin: 75%"),
+    ("Atlas Manufacturing", "Manufacturing & Industrial",
+     "Revenue: $100M, EBITDA: $15M (15% margin), YoY Growth: 8%, Gross Margin: 40%, Debt: $30M"),
+    ("Horizon Renewables", "Renewable Energy",
+     "Revenue: $30M, EBITDA: $3M (10% margin), YoY Growth: 50%, Gross Margin: 80%, ARR: $28M"),
+]
+
+LOAD_TEST_TOPICS = [
+    "Executive Summary",
+    "Company Overview",
+    "Industry Analysis",
+    "Financial Performance & Metrics",
+    "Valuation Analysis",
+    "Risk Assessment & Mitigation Strategies",
+]
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    """Ask the OS for an unused local port."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock_llm(latency, tokens_per_second, completion_tokens):
+    """Launch mock_llm.py in its own process and return (process, base_url)."""
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BASE_DIR, "mock_llm.py"),
+         "--port", "0",
+         "--latency", str(latency),
+         "--tokens-per-second", str(tokens_per_second),
+         "--completion-tokens", str(completion_tokens)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    # The first line announces the base URL
+    line = process.stdout.readline().strip()
+    base_url = line.rsplit(" ", 1)[-1]
+    return process, base_url
+
+
+def start_app_server(script, port, env):
+    """Launch `streamlit run` headlessly and wait until it answers its health check."""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", script,
+         "--server.headless", "true",
+         "--server.port", str(port),
+         "--server.address", "127.0.0.1",
+         "--browser.gatherUsageStats", "false"],
+        cwd=BASE_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as response:
+                if response.status == 200:
+                    return process
+        except OSError:
+            time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError("Streamlit server did not become healthy within 60s")
+
+
+def read_process_stats(pid):
+    """Return (cpu_seconds, rss_bytes) for a process from /proc (Linux only)."""
+    with open(f"/proc/{pid}/stat", "r") as f:
+        # Fields after the command name; utime and stime are the 12th and 13th of them
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    with open(f"/proc/{pid}/statm", "r") as f:
+        rss_bytes = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    return cpu_seconds, rss_bytes
+
+
+class ResourceSampler:
+    """Sample a server process's CPU utilisation and memory at a fixed interval on a background thread."""
+
+    def __init__(self, pid, interval=0.5):
+        """Initialize the sampler for the given process id."""
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        """Collect (elapsed, cpu_percent, rss_bytes) samples until stopped."""
+        start = time.perf_counter()
+        last_wall = start
+        last_cpu, _ = read_process_stats(self.pid)
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            try:
+                cpu, rss = read_process_stats(self.pid)
+            except OSError:
+                return
+            cpu_percent = 100.0 * (cpu - last_cpu) / max(now - last_wall, 1e-9)
+            self.samples.append((round(now - start, 2), round(cpu_percent, 1), rss))
+            last_wall, last_cpu = now, cpu
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class SimulatedSession:
+    """
+    A scripted browser session speaking Streamlit's websocket protocol.
+    Widgets are addressed by their user keys; every rerun sends the full widget state
+    like the frontend does and waits for the script to finish. Interacting with a widget
+    that lives in a fragment reruns only that fragment, as in the browser.
+    """
+
+    def __init__(self, port):
+        """Initialize the session for a server on the given port."""
+        self.url = f"ws://127.0.0.1:{port}/_stcore/stream"
+        self.connection = None
+        # user key -> widget id / enclosing fragment id, and widget id -> persistent WidgetState
+        self.widget_ids = {}
+        self.widget_fragments = {}
+        self.widget_states = {}
+        self.elements = []
+
+    async def connect(self):
+        """Open the websocket and run the script once, as a page load does."""
+        from tornado.websocket import websocket_connect
+        self.connection = await websocket_connect(self.url, max_message_size=64 * 2**20)
+        await self.rerun()
+
+    async def close(self):
+        """Close the websocket."""
+        if self.connection is not None:
+            self.connection.close()
+
+    def set_text(self, key, value):
+        """Type a value into a text input or text area."""
+        state = self._state(key)
+        state.string_value = value
+
+    def set_checkbox(self, key, value=True):
+        """Tick or untick a checkbox."""
+        state = self._state(key)
+        state.bool_value = value
+
+    def _state(self, key):
+        """Return the persistent WidgetState for a widget key."""
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        widget_id = self.widget_ids[key]
+        if widget_id not in self.widget_states:
+            self.widget_states[widget_id] = WidgetState(id=widget_id)
+        return self.widget_states[widget_id]
+
+    async def rerun(self, click=None, changed=None, timeout=300.0):
+        """
+        Send the widget state (plus an optional button click) and collect the elements of the run.
+        `changed` names the widget the user just edited so its fragment, if any, is rerun alone.
+        """
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.page_script_hash = ""
+        fragment_id = self.widget_fragments.get(click or changed)
+        if fragment_id:
+            msg.rerun_script.fragment_id = fragment_id
+        for state in self.widget_states.values():
+            msg.rerun_script.widget_states.widgets.append(state)
+        if click is not None:
+            msg.rerun_script.widget_states.widgets.append(WidgetState(id=self.widget_ids[click], trigger_value=True))
+        await self.connection.write_message(msg.SerializeToString(), binary=True)
+
+        self.elements = []
+        while True:
+            payload = await asyncio.wait_for(self.connection.read_message(), timeout)
+            if payload is None:
+                raise ConnectionError("Streamlit server closed the session")
+            forward = ForwardMsg()
+            forward.ParseFromString(payload)
+            kind = forward.WhichOneof("type")
+            if kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                element = forward.delta.new_element
+                element_type = element.WhichOneof("type")
+                self.elements.append((element_type, getattr(element, element_type)))
+                widget_id = getattr(getattr(element, element_type), "id", "")
+                if widget_id.startswith("$$WIDGET_ID-"):
+                    key = widget_id.split("-", 2)[-1]
+                    self.widget_ids[key] = widget_id
+                    self.widget_fragments[key] = forward.delta.fragment_id
+            elif kind == "script_finished":
+                if forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    return self.elements
+
+    def alerts(self, alert_format):
+        """Return the bodies of st.success/st.error/... messages from the last run."""
+        from streamlit.proto.Alert_pb2 import Alert
+        wanted = Alert.Format.Value(alert_format)
+        return [e.body for kind, e in self.elements if kind == "alert" and e.format == wanted]
+
+    def exceptions(self):
+        """Return exception messages shown by the last run."""
+        return [e.message for kind, e in self.elements if kind == "exception"]
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile of values using linear interpolation."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+async def run_virtual_user(port, user_id, reports, topics, think_time, timeout):
+    """Fill the company form, select topics and generate reports like an analyst would."""
+    rng = random.Random(user_id)
+    latencies = []
+    errors = 0
+    for _ in range(reports):
+        name, industry, financials = rng.choice(LOAD_TEST_COMPANIES)
+        session = SimulatedSession(port)
+        try:
+            await session.connect()
+            session.set_text("input_company_name", name)
+            session.set_text("input_company_industry", industry)
+            session.set_text("input_company_financials", financials)
+            await session.rerun(changed="input_company_financials")
+            await asyncio.sleep(rng.uniform(0, think_time))
+
+            for topic in rng.sample(LOAD_TEST_TOPICS, topics):
+                session.set_checkbox(f"topic_{topic}")
+                await session.rerun(changed=f"topic_{topic}")
+            await asyncio.sleep(rng.uniform(0, think_time))
+
+            start = time.perf_counter()
+            await session.rerun(click="generate_comprehensive", timeout=timeout)
+            if session.exceptions() or not session.alerts("SUCCESS"):
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors += 1
+        finally:
+            await session.close()
+    return {"latencies": latencies, "errors": errors}
+
+
+async def run_users(port, users, reports, topics, think_time, timeout):
+    """Run all virtual users of one level concurrently."""
+    results = await asyncio.gather(*(
+        run_virtual_user(port, user_id, reports, topics, think_time, timeout)
+        for user_id in range(users)
+    ))
+    return dict(enumerate(results))
+
+
+def run_level(port, server_pid, users, reports, topics, think_time, timeout, sample_interval):
+    """Run one concurrency level and summarise its latency, throughput and server resource usage."""
+    start = time.perf_counter()
+    with ResourceSampler(server_pid, sample_interval) as sampler:
+        results = asyncio.run(run_users(port, users, reports, topics, think_time, timeout))
+    elapsed = time.perf_counter() - start
+
+    all_latencies = [lat for r in results.values() for lat in r["latencies"]]
+    cpu_values = [s[1] for s in sampler.samples]
+    rss_values = [s[2] for s in sampler.samples]
+    return {
+        "users": users,
+        "reports": len(all_latencies),
+        "errors": sum(r["errors"] for r in results.values()),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_per_min": round(60.0 * len(all_latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_s": round(percentile(all_latencies, 50), 3),
+        "p90_s": round(percentile(all_latencies, 90), 3),
+        "p95_s": round(percentile(all_latencies, 95), 3),
+        "p99_s": round(percentile(all_latencies, 99), 3),
+        "max_s": round(max(all_latencies), 3) if all_latencies else 0.0,
+        "cpu_avg_percent": round(sum(cpu_values) / len(cpu_values), 1) if cpu_values else 0.0,
+        "cpu_max_percent": max(cpu_values) if cpu_values else 0.0,
+        "rss_max_mb": round(max(rss_values) / 2**20, 1) if rss_values else 0.0,
+        "per_user": {
+            str(user_id): {
+                "p50_s": round(percentile(r["latencies"], 50), 3),
+                "p95_s": round(percentile(r["latencies"], 95), 3),
+                "errors": r["errors"],
+            }
+            for user_id, r in sorted(results.items())
+        },
+        "samples": sampler.samples,
+    }
+
+
+async def profile_interactions(port, server_pid, repeat):
+    """
+    Time single interactions in one session: wall time until the (fragment) run finishes
+    and the server CPU it consumed. Returns {interaction: [(wall_s, cpu_s), ...]}.
+    """
+    from report_topics import REPORT_TOPICS
+
+    measurements = {}
+
+    async def measure(name, **rerun_args):
+        cpu_before, _ = read_process_stats(server_pid)
+        start = time.perf_counter()
+        await session.rerun(**rerun_args)
+        wall = time.perf_counter() - start
+        cpu_after, _ = read_process_stats(server_pid)
+        measurements.setdefault(name, []).append((wall, cpu_after - cpu_before))
+
+    for _ in range(repeat):
+        session = SimulatedSession(port)
+        cpu_before, _ = read_process_stats(server_pid)
+        start = time.perf_counter()
+        await session.connect()
+        measurements.setdefault("page load", []).append(
+            (time.perf_counter() - start, read_process_stats(server_pid)[0] - cpu_before)
+        )
+        try:
+            name, industry, financials = LOAD_TEST_COMPANIES[0]
+            for key, value in (("input_company_name", name),
+                               ("input_company_industry", industry),
+                               ("input_company_financials", financials)):
+                session.set_text(key, value)
+                await measure("edit company input", changed=key)
+            for checked in (True, False):
+                for topic in REPORT_TOPICS:
+                    session.set_checkbox(f"topic_{topic}", checked)
+                    await measure("toggle topic checkbox", changed=f"topic_{topic}")
+        finally:
+            await session.close()
+    return measurements
+
+
+def print_interaction_profile(measurements):
+    """Print wall time and server CPU per interaction type."""
+    print(f"{'interaction':<24}{'count':>7}{'mean ms':>10}{'p95 ms':>10}{'cpu ms/interaction':>20}")
+    for name, values in measurements.items():
+        walls = [w * 1000 for w, _ in values]
+        cpu = sum(c for _, c in values) * 1000 / len(values)
+        print(f"{name:<24}{len(values):>7}{sum(walls) / len(walls):>10.1f}{percentile(walls, 95):>10.1f}{cpu:>20.1f}")
+
+
+def find_saturation(levels, latency_factor, min_throughput_gain):
+    """
+    Return the first concurrency level where the app stops scaling:
+    p95 latency grows beyond latency_factor x the first level's,
+    or throughput improves by less than min_throughput_gain over the previous level.
+    """
+    if not levels:
+        return None
+    baseline = levels[0]["p95_s"] or 1e-9
+    for previous, level in zip(levels, levels[1:]):
+        if level["errors"] or level["p95_s"] > baseline * latency_factor:
+            return level["users"]
+        if level["throughput_per_min"] < previous["throughput_per_min"] * (1 + min_throughput_gain):
+            return level["users"]
+    return None
+
+
+def main(argv=None):
+    """Ramp concurrent virtual users against one app server and report where latency degrades."""
+    parser = argparse.ArgumentParser(description="Multi-session load test for the Streamlit app.")
+    parser.add_argument("--script", default="app.py", help="Streamlit script to serve")
+    parser.add_argument("--users", default="1,2,4,8,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--reports", type=int, default=2, help="Reports generated per virtual user per level")
+    parser.add_argument("--topics", type=int, default=3, help="Topics ticked per report")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Max seconds a user pauses between steps")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Seconds before a script run is abandoned")
+    parser.add_argument("--mock-latency", type=float, default=0.5, help="Mock LLM time to first token (s)")
+    parser.add_argument("--mock-tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--mock-completion-tokens", type=int, default=300)
+    parser.add_argument("--latency-factor", type=float, default=2.0, help="p95 growth that counts as saturation")
+    parser.add_argument("--min-throughput-gain", type=float, default=0.1)
+    parser.add_argument("--sample-interval", type=float, default=0.5)
+    parser.add_argument("--json", metavar="OUTPUT", help="Also write the full results (per-user, samples) as JSON")
+    parser.add_argument("--rerun-profile", action="store_true",
+                        help="Instead of ramping users, time single widget interactions (rerun wall time and "
+                             "server CPU); run against an older --script to compare before/after")
+    parser.add_argument("--repeat", type=int, default=5, help="Sessions measured by --rerun-profile")
+    args = parser.parse_args(argv)
+
+    mock_process, base_url = start_mock_llm(args.mock_latency, args.mock_tokens_per_second, args.mock_completion_tokens)
+    # Point the app's OpenAI client at the mock
+    env = dict(os.environ, OPENAI_API_KEY="mock-key", OPENAI_BASE_URL=base_url)
+    port = free_port()
+    app_process = start_app_server(args.script, port, env)
+    print(f"App on port {port} (pid {app_process.pid}), mock LLM at {base_url}")
+
+    if args.rerun_profile:
+        try:
+            print_interaction_profile(asyncio.run(profile_interactions(port, app_process.pid, args.repeat)))
+        finally:
+            app_process.terminate()
+            mock_process.terminate()
+        return 0
+
+    levels = []
+    try:
+        for users in (int(u) for u in args.users.split(",")):
+            level = run_level(port, app_process.pid, users, args.reports, args.topics,
+                              args.think_time, args.timeout, args.sample_interval)
+            levels.append(level)
+            print(f"users={level['users']:>3}  reports={level['reports']:>3}  errors={level['errors']:>2}  "
+                  f"p50={level['p50_s']:.2f}s  p95={level['p95_s']:.2f}s  max={level['max_s']:.2f}s  "
+                  f"thr={level['throughput_per_min']:.1f}/min  cpu={level['cpu_avg_percent']:.0f}% "
+                  f"(max {level['cpu_max_percent']:.0f}%)  rss={level['rss_max_mb']:.0f}MB", flush=True)
+    finally:
+        app_process.terminate()
+        mock_process.terminate()
+
+    saturation = find_saturation(levels, args.latency_factor, args.min_throughput_gain)
+    if saturation is None:
+        print("No saturation detected within the tested levels.")
+    else:
+        print(f"Saturation point: {saturation} concurrent users")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"levels": levels, "saturation_users": saturation}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
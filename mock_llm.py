@@ -0,0 +1,160 @@
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Filler vocabulary for generated text
+MOCK_WORDS = (
+    "revenue margin growth EBITDA cash flow leverage valuation multiple customer churn "
+    "pipeline retention benchmark sensitivity downside upside scenario capital efficiency"
+).split()
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """
+    Minimal stand-in for the OpenAI chat completions endpoint.
+    Answers with filler text after a configurable delay so the app can be exercised
+    without network access or API cost.
+    """
+
+    # Quiet the per-request access log
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        """Handle POST /v1/chat/completions (streaming and non-streaming)."""
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404, "Only /v1/chat/completions is mocked")
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        config = self.server.config
+
+        # Size the answer from max_tokens, capped by the configured completion size
+        completion_tokens = min(payload.get("max_tokens") or config["completion_tokens"], config["completion_tokens"])
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in payload.get("messages", [])) // 4
+        words = [random.choice(MOCK_WORDS) for _ in range(completion_tokens)]
+
+        if payload.get("stream"):
+            try:
+                self._stream(payload, words, prompt_tokens, config)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client stopped reading (e.g. a cancelled or timed-out call); nothing left to send
+                self.close_connection = True
+        else:
+            time.sleep(config["latency"] + completion_tokens / config["tokens_per_second"])
+            body = {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+    def _stream(self, payload, words, prompt_tokens, config):
+        """Send the completion as server-sent event chunks."""
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        time.sleep(config["latency"])
+        delay = 1.0 / config["tokens_per_second"]
+        for i, word in enumerate(words):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "mock"),
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(delay)
+
+        chunks = [{
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": payload.get("model", "mock"),
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }]
+        # Like the real API, usage arrives in a trailing chunk with no choices when requested
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            chunks.append({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "mock"),
+                "choices": [],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(words),
+                    "total_tokens": prompt_tokens + len(words),
+                },
+            })
+        for chunk in chunks:
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_server(port=0, latency=0.5, tokens_per_second=200.0, completion_tokens=300):
+    """Start the mock server on a background thread and return it (use server.server_address for the port)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockLLMHandler)
+    server.daemon_threads = True
+    server.config = {
+        "latency": latency,
+        "tokens_per_second": tokens_per_second,
+        "completion_tokens": completion_tokens,
+    }
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main(argv=None):
+    """Run the mock server in the foreground."""
+    parser = argparse.ArgumentParser(description="Local mock of the OpenAI chat completions API.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--completion-tokens", type=int, default=300, help="Tokens returned per completion")
+    args = parser.parse_args(argv)
+
+    server = start_server(args.port, args.latency, args.tokens_per_second, args.completion_tokens)
+    print(f"Mock LLM listening on http://127.0.0.1:{server.server_address[1]}/v1", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
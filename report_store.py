@@ -0,0 +1,146 @@
+import os
+import sys
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+
+class ReportStore:
+    """
+    Process-wide store for generated reports.
+    Sessions keep only the report ids (handles); the report text lives here and is
+    bounded by a per-session quota and a global byte budget with LRU eviction.
+    Reports of sessions that have closed are released by drop_closed_sessions.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, max_reports_per_session=5, max_bytes_per_session=16 * 2**20,
+                 session_grace_seconds=180):
+        """Initialize the store with global and per-session limits."""
+        self.max_bytes = max_bytes
+        self.max_reports_per_session = max_reports_per_session
+        self.max_bytes_per_session = max_bytes_per_session
+        # Closed sessions keep their reports this long, so a browser that reconnects still finds them
+        self.session_grace_seconds = session_grace_seconds
+        # report_id -> entry, least recently used first
+        self._entries = OrderedDict()
+        self._session_bytes = {}
+        self._total_bytes = 0
+        self._evictions = 0
+        # session_id -> time it was first seen closed
+        self._closed_since = {}
+        self._lock = threading.Lock()
+
+    def put(self, session_id, markdown_text, html_text, company_name=None, charts_html=""):
+        """Store a report (and its rendered charts) for a session and return its handle."""
+        report_id = uuid.uuid4().hex
+        entry = {
+            "session_id": session_id,
+            "company_name": company_name,
+            "markdown": markdown_text,
+            "html": html_text,
+            "charts_html": charts_html,
+            "created": time.time(),
+            "bytes": sys.getsizeof(markdown_text) + sys.getsizeof(html_text) + sys.getsizeof(charts_html),
+        }
+        with self._lock:
+            self._entries[report_id] = entry
+            self._session_bytes[session_id] = self._session_bytes.get(session_id, 0) + entry["bytes"]
+            self._total_bytes += entry["bytes"]
+
+            # Enforce the session quota first, oldest reports of that session go first
+            session_ids = [rid for rid, e in self._entries.items() if e["session_id"] == session_id]
+            while session_ids and session_ids[0] != report_id and (
+                len(session_ids) > self.max_reports_per_session
+                or self._session_bytes[session_id] > self.max_bytes_per_session
+            ):
+                self._evict(session_ids.pop(0))
+
+            # Then the global budget, least recently used across all sessions
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                if oldest == report_id:
+                    break
+                self._evict(oldest)
+        return report_id
+
+    def get(self, report_id):
+        """Return the stored report for a handle, or None if it was evicted."""
+        with self._lock:
+            entry = self._entries.get(report_id)
+            if entry is not None:
+                self._entries.move_to_end(report_id)
+            return entry
+
+    def live_handles(self, handles):
+        """Filter a session's handles down to the reports still held."""
+        with self._lock:
+            return [h for h in handles if h in self._entries]
+
+    def drop_session(self, session_id):
+        """Release every report held for a session."""
+        with self._lock:
+            self._drop_session(session_id)
+
+    def drop_closed_sessions(self, is_open):
+        """Release the reports of sessions that is_open(session_id) has reported closed for the grace period."""
+        now = time.time()
+        with self._lock:
+            for session_id in list(self._session_bytes):
+                if is_open(session_id):
+                    self._closed_since.pop(session_id, None)
+                elif now - self._closed_since.setdefault(session_id, now) >= self.session_grace_seconds:
+                    self._drop_session(session_id)
+            # Forget sessions whose reports are gone anyway
+            for session_id in [sid for sid in self._closed_since if sid not in self._session_bytes]:
+                del self._closed_since[session_id]
+
+    def _drop_session(self, session_id):
+        """Evict all of a session's reports (caller holds the lock)."""
+        for report_id in [rid for rid, e in self._entries.items() if e["session_id"] == session_id]:
+            self._evict(report_id)
+
+    def _evict(self, report_id):
+        """Remove an entry and update the byte accounting (caller holds the lock)."""
+        entry = self._entries.pop(report_id)
+        self._total_bytes -= entry["bytes"]
+        remaining = self._session_bytes[entry["session_id"]] - entry["bytes"]
+        if remaining > 0:
+            self._session_bytes[entry["session_id"]] = remaining
+        else:
+            del self._session_bytes[entry["session_id"]]
+        self._evictions += 1
+
+    def memory_report(self):
+        """Summarize bytes held per session, largest first."""
+        with self._lock:
+            sessions = {}
+            for entry in self._entries.values():
+                info = sessions.setdefault(entry["session_id"], {"session": entry["session_id"][:8], "reports": 0, "bytes": 0})
+                info["reports"] += 1
+                info["bytes"] += entry["bytes"]
+            return {
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "reports": len(self._entries),
+                "evictions": self._evictions,
+                "sessions": sorted(sessions.values(), key=lambda s: s["bytes"], reverse=True),
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_report_store():
+    """Return the process-wide report store, sized from REPORT_STORE_* environment variables."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ReportStore(
+                max_bytes=int(float(os.getenv("REPORT_STORE_MAX_MB", "256")) * 2**20),
+                max_reports_per_session=int(os.getenv("REPORT_STORE_SESSION_REPORTS", "5")),
+                max_bytes_per_session=int(float(os.getenv("REPORT_STORE_SESSION_MB", "16")) * 2**20),
+                session_grace_seconds=float(os.getenv("REPORT_STORE_SESSION_GRACE_SECONDS", "180")),
+            )
+        return _store
@@ -0,0 +1,28 @@
+# Unified report topics with descriptions
+REPORT_TOPICS = {
+    "Executive Summary": "A concise overview of the company's financial position, key strengths, risks, and investment potential.",
+    "Company Overview": "Background information on the company's history, business model, products/services, and market positioning.",
+    "Industry Analysis": "Assessment of industry trends, market size, growth rates, and key success factors in the company's sector.",
+    "Financial Performance & Metrics": "Detailed analysis of revenue, profitability, cash flow, and key financial ratios with historical context.",
+    "Valuation Analysis": "Estimation of company value using multiple methodologies (DCF, comparable companies, precedent transactions).",
+    "Capital Structure & Debt Profile": "Analysis of the company's debt, equity, leverage ratios, and financing options.",
+    "Operational Assessment": "Evaluation of operational efficiency, production capacity, supply chain, and cost structure.",
+    "Management & Governance": "Assessment of leadership team, board composition, decision-making processes, and corporate governance.",
+    "Legal & Regulatory Considerations": "Overview of legal compliance, regulatory environment, and potential legal risks or opportunities.",
+    "Market Position & Competitive Analysis": "Evaluation of market share, competitive advantages, and positioning relative to competitors.",
+    "Customer & Supplier Relationships": "Analysis of customer concentration, supplier dependencies, and relationship management.",
+    "Risk Assessment & Mitigation Strategies": "Identification of key business, financial, and market risks with mitigation approaches.",
+    "Growth Opportunities & Forecasts": "Projection of future performance and identification of growth avenues and expansion potential.",
+    "Investment Thesis & Recommendations": "Strategic rationale for investment with clear recommendations and expected returns.",
+    "Exit Strategy Considerations": "Analysis of potential exit options, timing, and value creation opportunities for investors."
+}
+
+# Topics organized into sidebar categories
+TOPIC_CATEGORIES = {
+    "Overview": ["Executive Summary", "Company Overview"],
+    "Market Analysis": ["Industry Analysis", "Market Position & Competitive Analysis"],
+    "Financial Analysis": ["Financial Performance & Metrics", "Valuation Analysis", "Capital Structure & Debt Profile"],
+    "Operations": ["Operational Assessment", "Management & Governance", "Customer & Supplier Relationships"],
+    "Risk & Growth": ["Risk Assessment & Mitigation Strategies", "Growth Opportunities & Forecasts", "Legal & Regulatory Considerations"],
+    "Investment": ["Investment Thesis & Recommendations", "Exit Strategy Considerations"]
+}
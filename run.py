@@ -7,8 +7,8 @@ def check_dependencies():
     try:
         import streamlit
         import openai
-        import pandas
-        import plotly
+        import numpy
+        import matplotlib
         import dotenv
         print("✅ All dependencies are installed.")
         return True
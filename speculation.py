@@ -0,0 +1,191 @@
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import get_tracer
+from admission import get_admission_controller
+
+# Commonly selected sections that can be written without seeing the other sections
+SPECULATIVE_SECTIONS = ["Company Overview", "Industry Analysis", "Financial Performance & Metrics"]
+
+
+def inputs_key(company_data, model):
+    """Hash of the company inputs and model a speculation was started for."""
+    raw = "\x1f".join([model, company_data["name"], company_data["industry"], company_data["financials"]])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SpeculativeCache:
+    """
+    Generates commonly selected sections in the background while a user is still picking topics.
+    A session's speculation starts once its company inputs have been unchanged for `delay` seconds,
+    is cancelled when they change, and its results expire `ttl` seconds after it started.
+    Each session may start at most `max_calls_per_session` section calls. With an admission
+    controller, speculation reserves its estimated tokens first and is skipped while reports wait.
+    """
+
+    def __init__(self, agent, sections=None, delay=3.0, ttl=300.0, max_calls_per_session=6, max_workers=4,
+                 admission=None):
+        """Create the cache and its worker threads for the given FinanceAgent."""
+        self.agent = agent
+        self.admission = admission
+        self.sections = list(sections or SPECULATIVE_SECTIONS)
+        self.delay = delay
+        self.ttl = ttl
+        self.max_calls_per_session = max_calls_per_session
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="speculation")
+        self._lock = threading.Lock()
+        # session_id -> {"key", "timer", "futures", "started", "calls", "touched"}
+        self._sessions = {}
+        self._stats = {"submitted": 0, "used": 0, "wasted": 0, "cancelled": 0, "missed": 0, "skipped": 0}
+
+    def observe(self, session_id, company_data):
+        """Note a session's current inputs, (re)scheduling speculation when they change."""
+        filled = all(company_data.get(field) for field in ("name", "industry", "financials"))
+        key = inputs_key(company_data, self.agent.model) if filled else None
+        with self._lock:
+            self._expire_idle_sessions()
+            state = self._sessions.setdefault(session_id, {"key": None, "timer": None, "futures": {}, "started": None, "calls": 0})
+            state["touched"] = time.monotonic()
+            if state["key"] == key:
+                return
+            self._cancel(state)
+            state["key"] = key
+            if key is None:
+                return
+            # Debounce: only inputs left untouched for `delay` seconds are worth speculating on
+            timer = threading.Timer(self.delay, self._start, (session_id, key, dict(company_data)))
+            timer.daemon = True
+            state["timer"] = timer
+            timer.start()
+
+    def take(self, session_id, company_data, details):
+        """
+        Hand over speculative results for the requested sections as {section: content}.
+        Sections still being generated are waited for; unrequested ones are cancelled.
+        """
+        key = inputs_key(company_data, self.agent.model)
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None or state["key"] != key or self._is_expired(state):
+                if state is not None:
+                    self._cancel(state)
+                self._stats["missed"] += sum(1 for detail in details if detail in self.sections)
+                return {}
+            if state["timer"] is not None:
+                state["timer"].cancel()
+                state["timer"] = None
+            futures, state["futures"] = state["futures"], {}
+            # Unrequested sections are dropped; the inputs stay recorded so they are not re-speculated
+            for section, future in list(futures.items()):
+                if section not in details:
+                    self._discard(state, future)
+                    del futures[section]
+
+        results = {}
+        for section, future in futures.items():
+            try:
+                results[section] = future.result()
+            except Exception:
+                # Failed speculation; the real request generates this section itself
+                continue
+        with self._lock:
+            self._stats["used"] += len(results)
+            self._stats["wasted"] += len(futures) - len(results)
+            self._stats["missed"] += sum(1 for detail in details if detail in self.sections and detail not in results)
+        return results
+
+    def stats(self):
+        """Return counters and the hit rate (used / finished speculative calls)."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = sum(len(state["futures"]) for state in self._sessions.values())
+            stats["sessions"] = len(self._sessions)
+        finished = stats["used"] + stats["wasted"]
+        stats["hit_rate"] = stats["used"] / finished if finished else None
+        return stats
+
+    def _start(self, session_id, key, company_data):
+        """Timer callback: submit the speculative sections within the session's call and token budgets."""
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None or state["key"] != key:
+                return
+            state["timer"] = None
+            budget = self.max_calls_per_session - state["calls"]
+            sections = self.sections[:max(budget, 0)]
+            if not sections:
+                return
+            # Real reports go first: speculate only on tokens the admission controller can spare now.
+            # The estimate includes a conclusion call, so the reservation errs on the high side.
+            if self.admission is not None:
+                estimate = self.agent.estimate_report(company_data, {"Speculation": sections})
+                if not self.admission.try_reserve(session_id, estimate["total_tokens"]):
+                    self._stats["skipped"] += len(sections)
+                    return
+            state["calls"] += len(sections)
+            state["started"] = time.monotonic()
+            self._stats["submitted"] += len(sections)
+            for section in sections:
+                state["futures"][section] = self._executor.submit(self._generate, section, company_data)
+
+    def _generate(self, section, company_data):
+        """Generate one section on a worker thread."""
+        with get_tracer().span("speculation.section", topic=section, company=company_data["name"]):
+            return self.agent.generate_section(section, company_data)
+
+    def _cancel(self, state):
+        """Drop a session's pending timer and speculative calls (caller holds the lock)."""
+        if state["timer"] is not None:
+            state["timer"].cancel()
+            state["timer"] = None
+        for future in state["futures"].values():
+            self._discard(state, future)
+        state["futures"] = {}
+        state["key"] = None
+
+    def _discard(self, state, future):
+        """Cancel a queued call, refunding its budget, or write off one that already ran."""
+        if future.cancel():
+            state["calls"] -= 1
+            self._stats["cancelled"] += 1
+        else:
+            self._stats["wasted"] += 1
+
+    def _is_expired(self, state):
+        return state["started"] is not None and time.monotonic() - state["started"] > self.ttl
+
+    def _expire_idle_sessions(self):
+        """Forget sessions not seen for longer than the TTL (caller holds the lock)."""
+        now = time.monotonic()
+        for session_id, state in list(self._sessions.items()):
+            if now - state["touched"] > self.ttl:
+                self._cancel(state)
+                del self._sessions[session_id]
+
+
+def speculation_enabled():
+    """Speculative generation is opt-in with SPECULATIVE_GENERATION=1."""
+    return os.getenv("SPECULATIVE_GENERATION", "").lower() in ("1", "true", "yes")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_speculative_cache(agent):
+    """Return the process-wide speculative cache, configured from SPECULATION_* environment variables."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SpeculativeCache(
+                agent,
+                delay=float(os.getenv("SPECULATION_DELAY_SECONDS", "3")),
+                ttl=float(os.getenv("SPECULATION_TTL_SECONDS", "300")),
+                max_calls_per_session=int(os.getenv("SPECULATION_SESSION_CALLS", "6")),
+                max_workers=int(os.getenv("SPECULATION_WORKERS", "4")),
+                admission=get_admission_controller(),
+            )
+        return _cache
@@ -0,0 +1,153 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+import admission
+from admission import AdmissionController, AdmissionRejected
+
+ESTIMATE = {"total_tokens": 1000, "latency_seconds": 2.0}
+
+
+def test_least_recently_served_user_goes_first():
+    controller = AdmissionController(max_concurrent=1, max_per_user=2)
+    a1 = controller.enqueue("alice", ESTIMATE)
+    assert controller.try_admit(a1)
+    a2 = controller.enqueue("alice", ESTIMATE)
+    b1 = controller.enqueue("bob", ESTIMATE)
+    assert not controller.try_admit(a2)
+    assert not controller.try_admit(b1)
+
+    controller.release(a1)
+    # Alice arrived first but was just served, so Bob overtakes her
+    assert not controller.try_admit(a2)
+    assert controller.try_admit(b1)
+    controller.release(b1)
+    assert controller.try_admit(a2)
+
+
+def test_user_at_their_limit_does_not_hold_up_others():
+    controller = AdmissionController(max_concurrent=4, max_per_user=1)
+    a1 = controller.enqueue("alice", ESTIMATE)
+    assert controller.try_admit(a1)
+    a2 = controller.enqueue("alice", ESTIMATE)
+    b1 = controller.enqueue("bob", ESTIMATE)
+    assert not controller.try_admit(a2)
+    assert controller.try_admit(b1)
+    assert controller.stats()["running"] == 2
+
+
+def test_global_token_budget_blocks_everyone(monkeypatch):
+    monkeypatch.setattr(admission, "TOKEN_WINDOW_SECONDS", 0.2)
+    controller = AdmissionController(max_concurrent=4, tokens_per_minute=1500, max_wait=10)
+    a1 = controller.enqueue("alice", ESTIMATE)
+    assert controller.try_admit(a1)
+    controller.release(a1)
+    b1 = controller.enqueue("bob", ESTIMATE)
+    assert 0 < b1["predicted_wait"] <= 0.2
+    assert not controller.try_admit(b1)
+
+    time.sleep(0.25)
+    assert controller.try_admit(b1)
+
+
+def test_user_token_budget_only_blocks_that_user():
+    controller = AdmissionController(max_concurrent=4, max_per_user=0, user_tokens_per_minute=1500, max_wait=120)
+    a1 = controller.enqueue("alice", ESTIMATE)
+    assert controller.try_admit(a1)
+    a2 = controller.enqueue("alice", ESTIMATE)
+    b1 = controller.enqueue("bob", ESTIMATE)
+    assert not controller.try_admit(a2)
+    assert controller.try_admit(b1)
+
+
+def test_requests_are_shed_with_a_reason():
+    controller = AdmissionController(max_concurrent=1, max_per_user=1, tokens_per_minute=5000, max_queue=2, max_wait=3)
+
+    with pytest.raises(AdmissionRejected, match="per-minute quota"):
+        controller.enqueue("alice", dict(ESTIMATE, total_tokens=6000))
+
+    running = controller.enqueue("alice", ESTIMATE)
+    assert controller.try_admit(running)
+    controller.enqueue("alice", ESTIMATE)
+    with pytest.raises(AdmissionRejected, match="already have reports waiting") as rejected:
+        controller.enqueue("alice", ESTIMATE)
+    assert rejected.value.retry_after == 30
+
+    # Bob would wait for Alice's running and queued reports: 4 s is over max_wait
+    with pytest.raises(AdmissionRejected, match="about 4 seconds") as rejected:
+        controller.enqueue("bob", ESTIMATE)
+    assert rejected.value.retry_after == 4
+
+    controller.max_wait = 300
+    controller.enqueue("bob", ESTIMATE)
+    with pytest.raises(AdmissionRejected, match="2 reports waiting"):
+        controller.enqueue("carol", ESTIMATE)
+    assert controller.stats()["shed"] == 4
+
+
+def test_waiting_too_long_is_shed_and_leaves_the_queue():
+    controller = AdmissionController(max_concurrent=1, max_wait=5)
+    running = controller.enqueue("alice", ESTIMATE)
+    assert controller.try_admit(running)
+    waiting = controller.enqueue("bob", ESTIMATE)
+
+    controller.max_wait = 0.1
+    with pytest.raises(AdmissionRejected, match="stayed busy"):
+        controller.wait(waiting, poll=0.02)
+    stats = controller.stats()
+    assert (stats["queued"], stats["timed_out"]) == (0, 1)
+
+
+def test_admit_waits_for_a_slot_and_releases_it():
+    controller = AdmissionController(max_concurrent=1)
+    positions = []
+    order = []
+
+    def report(user, seconds, on_wait=None):
+        with controller.admit(user, ESTIMATE, on_wait=on_wait):
+            order.append(user)
+            time.sleep(seconds)
+
+    first = threading.Thread(target=report, args=("alice", 0.2))
+    first.start()
+    time.sleep(0.05)
+    report("bob", 0, on_wait=lambda position, wait: positions.append(position))
+    first.join()
+
+    assert order == ["alice", "bob"]
+    assert positions and set(positions) == {1}
+    assert controller.stats()["running"] == 0
+
+
+def test_admit_frees_the_slot_when_the_block_raises():
+    controller = AdmissionController(max_concurrent=1)
+    with pytest.raises(RuntimeError):
+        with controller.admit("alice", ESTIMATE):
+            raise RuntimeError("generation failed")
+    with controller.admit("bob", ESTIMATE):
+        assert controller.stats()["running"] == 1
+
+
+def test_wait_async_admits_once_a_slot_is_free():
+    controller = AdmissionController(max_concurrent=1)
+
+    async def main():
+        running = controller.enqueue("alice", ESTIMATE)
+        await controller.wait_async(running)
+        waiting = controller.enqueue("bob", ESTIMATE)
+        asyncio.get_running_loop().call_later(0.1, controller.release, running)
+        await asyncio.wait_for(controller.wait_async(waiting, poll=0.02), timeout=2)
+        return waiting
+
+    waiting = asyncio.run(main())
+    assert controller._running == {waiting["id"]: waiting}
+
+
+@pytest.mark.parametrize("seconds, text", [
+    (0, "1 second"), (0.4, "1 second"), (1.2, "2 seconds"), (89.2, "2 minutes"), (89.0, "89 seconds"),
+    (90, "2 minutes"), (120, "2 minutes"), (121, "3 minutes"), (600, "10 minutes"),
+])
+def test_describe_wait_rounds_up_and_pluralizes(seconds, text):
+    assert admission.describe_wait(seconds) == text
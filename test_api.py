@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from api import ReportJob, read_body, BodyTooLarge, MAX_BODY_BYTES
+
+
+def publish_all(job, events):
+    async def run():
+        for event, data in events:
+            await job.publish(event, data)
+        await job.close()
+    asyncio.run(run())
+
+
+def report_events():
+    events = [("status", {"status": "running"})]
+    for index, section in enumerate(["Company Overview", "Industry Analysis"], 1):
+        events.append(("section_started", {"section": section, "index": index, "total": 2}))
+        events += [("token", {"section": section, "text": f"{section[0]}{i} "}) for i in range(50)]
+        events.append(("section_completed", {"section": section, "index": index, "total": 2}))
+    events.append(("conclusion_started", {}))
+    events += [("token", {"section": "Conclusion", "text": f"C{i} "}) for i in range(20)]
+    events.append(("done", {"status": "completed"}))
+    return events
+
+
+def text_of(pending):
+    return "".join(data["text"] for _, event, data in pending if event == "token")
+
+
+def test_tokens_are_merged_per_section():
+    job = ReportJob("Report", {}, {"Comprehensive Analysis": ["Company Overview", "Industry Analysis"]})
+    events = report_events()
+    publish_all(job, events)
+
+    # status, 2 x (started, tokens, completed), conclusion_started, conclusion tokens, done
+    assert len(job.events) == 10
+    assert job.next_id == len(events)
+    pending = job.events_after(-1)
+    assert [event for _, event, _ in pending if event != "token"] == [event for event, _ in events if event != "token"]
+    assert text_of(pending) == "".join(data["text"] for event, data in events if event == "token")
+    assert pending[-1][0] == len(events) - 1
+
+
+def test_resume_inside_a_merged_section_sends_only_the_rest():
+    job = ReportJob("Report", {}, {"Comprehensive Analysis": ["Company Overview", "Industry Analysis"]})
+    events = report_events()
+    publish_all(job, events)
+
+    for last_id in (2, 10, 51, 52, 60, len(events) - 3, len(events) - 1):
+        expected = "".join(data["text"] for event, data in events[last_id + 1:] if event == "token")
+        pending = job.events_after(last_id)
+        assert text_of(pending) == expected
+        assert all(event_id > last_id for event_id, _, _ in pending)
+
+
+def test_live_tokens_are_streamed_before_merging():
+    job = ReportJob("Report", {}, {"Comprehensive Analysis": ["Company Overview"]})
+    publish_all(job, report_events()[:12])
+    # Ids 2-11 are the first ten tokens, not yet merged since the section is still running
+    assert job.events_after(5) == [(i, "token", {"section": "Company Overview", "text": f"C{i - 2} "}) for i in range(6, 12)]
+
+
+def test_oversized_body_is_refused():
+    async def receive():
+        return {"type": "http.request", "body": b"x" * (MAX_BODY_BYTES + 1), "more_body": False}
+
+    with pytest.raises(BodyTooLarge):
+        asyncio.run(read_body(receive))
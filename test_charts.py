@@ -0,0 +1,46 @@
+import base64
+
+import pytest
+
+from charts import parse_financials, build_figures, figure_to_data_uri
+
+
+@pytest.mark.parametrize("ebitda", ["-$6M", "$-6M", "($6M)", "( $6M )", "- $6M"])
+def test_negative_ebitda_keeps_its_sign(ebitda):
+    metrics = parse_financials(f"Revenue: $40M, EBITDA: {ebitda}, Gross Margin: 55%")
+    assert metrics["ebitda"] == -6e6
+    assert metrics["ebitda_margin"] == pytest.approx(-15.0)
+
+
+def test_negative_percentage_in_parentheses():
+    assert parse_financials("EBITDA Margin: (12%)")["ebitda_margin"] == -12.0
+
+
+def test_leading_year_is_not_the_amount():
+    assert parse_financials("Revenue: 2024 $25M")["revenue"] == 25e6
+    assert parse_financials("Revenue: FY2024 $25M, Growth: 30% YoY") == {"revenue": 25e6, "growth": 30.0}
+
+
+def test_bare_number_that_looks_like_a_year_is_kept():
+    assert parse_financials("LTV: 2000")["ltv"] == 2000.0
+
+
+def test_margin_stated_with_ebitda():
+    metrics = parse_financials("Revenue: $25M, EBITDA: $5M (20% margin), CAC: $1,200, LTV: $4.8K")
+    assert metrics == {"revenue": 25e6, "ebitda": 5e6, "ebitda_margin": 20.0, "cac": 1200.0, "ltv": 4800.0}
+
+
+def test_loss_making_company_still_gets_figures():
+    metrics = parse_financials("Revenue: $40M, EBITDA: ($6M), Gross Margin: 55%, Growth: 20%")
+    assert [title for title, _ in build_figures(metrics)] == ["Margin bridge", "EBITDA sensitivity"]
+
+
+@pytest.mark.parametrize("financials", ["CAC: $0, LTV: $4.8K", "CAC: -$1,200, LTV: $4.8K", "CAC: $1,200, LTV: $0"])
+def test_unit_economics_needs_positive_cac_and_ltv(financials):
+    assert build_figures(parse_financials(financials)) == []
+
+
+def test_svg_keeps_text_as_text():
+    [(_, fig)] = build_figures(parse_financials("CAC: $1,200, LTV: $4.8K"))
+    svg = base64.b64decode(figure_to_data_uri(fig).split(",", 1)[1]).decode("utf-8")
+    assert "LTV/CAC 4.0x" in svg
@@ -0,0 +1,129 @@
+import time
+
+import pytest
+
+from distributed import TaskQueue
+
+COMPANY = {"name": "Acme", "industry": "Software", "financials": "Revenue: $10M"}
+TOPICS = ["Company Overview", "Industry Analysis"]
+
+
+@pytest.fixture
+def queue_path(tmp_path):
+    return str(tmp_path / "queue.sqlite")
+
+
+def open_queue(queue_path, **kwargs):
+    kwargs.setdefault("retry_backoff", 0.0)
+    return TaskQueue(queue_path, **kwargs)
+
+
+def conclusions(queue):
+    return queue.db.execute("SELECT * FROM tasks WHERE kind = 'conclusion'").fetchall()
+
+
+def run_sections(queue, worker_id="w1"):
+    """Lease and complete every available section task."""
+    while True:
+        task = queue.lease(worker_id)
+        if task is None or task["kind"] != "section":
+            return task
+        assert queue.complete(task["id"], worker_id, f"{task['topic']} content")
+
+
+def test_sections_then_one_conclusion_then_ready(queue_path):
+    queue = open_queue(queue_path)
+    run_id = queue.submit([COMPANY], TOPICS)
+
+    conclusion = run_sections(queue)
+    assert conclusion["kind"] == "conclusion"
+    assert len(conclusions(queue)) == 1
+    assert queue.ready_reports(run_id) == []
+
+    assert queue.complete(conclusion["id"], "w1", "Summary")
+    [report] = queue.ready_reports(run_id)
+    assert report["sections"] == {"Company Overview": "Company Overview content",
+                                  "Industry Analysis": "Industry Analysis content"}
+    assert report["conclusion"] == "Summary"
+    assert queue.status(run_id)["reports"] == {"ready": 1}
+
+
+def test_expired_lease_is_taken_over_and_the_old_owner_loses_it(queue_path):
+    queue = open_queue(queue_path, lease_seconds=0.05)
+    queue.submit([COMPANY], TOPICS[:1])
+
+    first = queue.lease("w1")
+    assert queue.lease("w2") is None
+    time.sleep(0.1)
+    second = queue.lease("w2")
+    assert second["id"] == first["id"]
+    assert second["attempts"] == 2
+
+    assert not queue.heartbeat(first["id"], "w1")
+    assert not queue.complete(first["id"], "w1", "stale result")
+    assert queue.complete(second["id"], "w2", "fresh result")
+    assert queue.section_results(first["report_id"]) == {"Company Overview": "fresh result"}
+
+
+def test_failed_attempts_are_retried_then_the_section_fails(queue_path):
+    queue = open_queue(queue_path, max_attempts=2)
+    run_id = queue.submit([COMPANY], TOPICS)
+
+    for attempt in (1, 2):
+        task = queue.lease("w1")
+        assert (task["topic"], task["attempts"]) == ("Company Overview", attempt)
+        queue.fail(task["id"], "w1", f"RateLimitError: attempt {attempt}")
+
+    # The other section still finishes, and the conclusion is queued exactly once
+    conclusion = run_sections(queue)
+    assert conclusion["kind"] == "conclusion"
+    assert len(conclusions(queue)) == 1
+    assert queue.complete(conclusion["id"], "w1", "Summary")
+    assert len(conclusions(queue)) == 1
+
+    [report] = queue.ready_reports(run_id)
+    assert report["sections"]["Company Overview"] == \
+        "Error generating content for Company Overview: RateLimitError: attempt 2"
+    assert report["sections"]["Industry Analysis"] == "Industry Analysis content"
+
+
+def test_lease_expiring_on_the_last_attempt_fails_the_task(queue_path):
+    queue = open_queue(queue_path, lease_seconds=0.05, max_attempts=1)
+    run_id = queue.submit([COMPANY], TOPICS[:1])
+
+    queue.lease("w1")
+    time.sleep(0.1)
+    conclusion = queue.lease("w2")
+    assert conclusion["kind"] == "conclusion"
+    assert len(conclusions(queue)) == 1
+
+    queue.fail(conclusion["id"], "w2", "APIError: down")
+    [report] = queue.ready_reports(run_id)
+    assert report["sections"] == {"Company Overview": "Error generating content for Company Overview: lease expired"}
+    assert report["conclusion"] == "Error generating conclusion: APIError: down"
+
+
+def test_deferred_task_keeps_its_attempts(queue_path):
+    queue = open_queue(queue_path, max_attempts=1)
+    queue.submit([COMPANY], TOPICS[:1])
+
+    task = queue.lease("w1")
+    assert queue.defer(task["id"], "w1", 0.0)
+    assert not queue.defer(task["id"], "w1", 0.0)
+    again = queue.lease("w2")
+    assert (again["id"], again["attempts"]) == (task["id"], 1)
+
+
+def test_collected_reports_are_not_returned_again(queue_path):
+    queue = open_queue(queue_path)
+    run_id = queue.submit([COMPANY, dict(COMPANY, name="Beta")], TOPICS[:1])
+    # Two sections and two conclusions
+    for _ in range(4):
+        task = queue.lease("w1")
+        queue.complete(task["id"], "w1", "content")
+    assert queue.lease("w1") is None
+
+    reports = queue.ready_reports(run_id)
+    assert sorted(r["company_data"]["name"] for r in reports) == ["Acme", "Beta"]
+    queue.mark_collected(reports[0]["id"])
+    assert [r["id"] for r in queue.ready_reports(run_id)] == [reports[1]["id"]]
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from industry_cache import IndustryCache, IndustryCacheBusy
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return IndustryCache(str(tmp_path / "industry.sqlite"), ttl=3600)
+
+
+def test_entries_are_shared_across_spellings_of_the_industry(cache):
+    assert cache.get_or_create("Software & Technology", "Industry Analysis", "gpt-4o", lambda: "base") == ("base", False)
+    assert cache.get_or_create(" software  &  technology", "Industry Analysis", "gpt-4o", lambda: "other") == ("base", True)
+    assert cache.peek("SOFTWARE & TECHNOLOGY", "Industry Analysis", "gpt-4o") == "base"
+
+
+def test_no_wait_raises_while_another_caller_generates(cache):
+    key = ("software", "Industry Analysis", "gpt-4o")
+    assert cache._claim(key, "other-owner") == ("acquired", None)
+    with pytest.raises(IndustryCacheBusy):
+        cache.get_or_create("Software", "Industry Analysis", "gpt-4o", lambda: "base", wait=False)
+    cache._store(key, "other-owner", "base")
+    assert cache.get_or_create("Software", "Industry Analysis", "gpt-4o", lambda: "again", wait=False) == ("base", True)
+
+
+def test_failed_generation_releases_the_lock(cache):
+    def fail():
+        raise RuntimeError("provider error")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_create("Software", "Industry Analysis", "gpt-4o", fail)
+    assert cache.get_or_create("Software", "Industry Analysis", "gpt-4o", lambda: "base", wait=False) == ("base", False)
+
+
+def test_concurrent_async_callers_generate_once(cache):
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.2)
+        return "base"
+
+    async def main():
+        return await asyncio.gather(*(
+            cache.get_or_create_async("Software", "Industry Analysis", "gpt-4o", generate) for _ in range(5)
+        ))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert sorted(results) == [("base", False)] + [("base", True)] * 4
@@ -0,0 +1,78 @@
+import sys
+import time
+
+from report_store import ReportStore
+
+TEXT = "x" * 1000
+SIZE = 3 * sys.getsizeof(TEXT)
+
+
+def put(store, session_id):
+    return store.put(session_id, TEXT, TEXT, charts_html=TEXT)
+
+
+def test_least_recently_used_report_is_evicted_first():
+    store = ReportStore(max_bytes=3 * SIZE)
+    a, b, c = put(store, "s1"), put(store, "s2"), put(store, "s3")
+    # Reading the oldest report makes b the least recently used
+    assert store.get(a)["markdown"] == TEXT
+    d = put(store, "s4")
+    assert store.live_handles([a, b, c, d]) == [a, c, d]
+    assert store.get(b) is None
+    assert store.memory_report()["evictions"] == 1
+
+
+def test_session_quota_evicts_only_that_sessions_oldest_reports():
+    store = ReportStore(max_reports_per_session=2)
+    other = put(store, "s2")
+    first, second, third = put(store, "s1"), put(store, "s1"), put(store, "s1")
+    assert store.live_handles([other, first, second, third]) == [other, second, third]
+
+    store = ReportStore(max_bytes_per_session=2 * SIZE)
+    first, second, third = put(store, "s1"), put(store, "s1"), put(store, "s1")
+    assert store.live_handles([first, second, third]) == [second, third]
+
+
+def test_a_report_larger_than_the_budget_is_still_kept():
+    store = ReportStore(max_bytes=SIZE // 2, max_bytes_per_session=SIZE // 2)
+    old = put(store, "s1")
+    new = put(store, "s1")
+    assert store.live_handles([old, new]) == [new]
+
+
+def test_byte_accounting_follows_evictions_and_drops():
+    store = ReportStore(max_bytes=3 * SIZE, max_reports_per_session=2)
+    for session_id in ("s1", "s1", "s1", "s2", "s2"):
+        put(store, session_id)
+    report = store.memory_report()
+    assert (report["total_bytes"], report["reports"], report["evictions"]) == (3 * SIZE, 3, 2)
+    assert {s["session"]: s["bytes"] for s in report["sessions"]} == {"s1": SIZE, "s2": 2 * SIZE}
+
+    store.drop_session("s2")
+    report = store.memory_report()
+    assert (report["total_bytes"], report["reports"]) == (SIZE, 1)
+    assert store._session_bytes == {"s1": SIZE}
+
+
+def test_closed_sessions_are_dropped_after_the_grace_period():
+    store = ReportStore(session_grace_seconds=0.1)
+    kept, closed = put(store, "open"), put(store, "closed")
+    is_open = lambda session_id: session_id == "open"
+
+    store.drop_closed_sessions(is_open)
+    assert store.live_handles([kept, closed]) == [kept, closed]
+    time.sleep(0.15)
+    store.drop_closed_sessions(is_open)
+    assert store.live_handles([kept, closed]) == [kept]
+    assert store._closed_since == {}
+
+
+def test_reopened_session_restarts_the_grace_period():
+    store = ReportStore(session_grace_seconds=0.1)
+    handle = put(store, "s1")
+    store.drop_closed_sessions(lambda session_id: False)
+    time.sleep(0.15)
+    # The browser reconnected before the next sweep
+    store.drop_closed_sessions(lambda session_id: True)
+    store.drop_closed_sessions(lambda session_id: False)
+    assert store.live_handles([handle]) == [handle]
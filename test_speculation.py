@@ -0,0 +1,107 @@
+import time
+import threading
+
+import pytest
+
+from admission import AdmissionController
+from speculation import SpeculativeCache
+
+COMPANY = {"name": "Acme", "industry": "Software", "financials": "Revenue: $10M"}
+SECTIONS = ["Company Overview", "Industry Analysis", "Financial Performance & Metrics"]
+
+
+class StubAgent:
+    """Stands in for FinanceAgent: sections finish once `release` is set."""
+
+    model = "gpt-4o"
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = []
+
+    def generate_section(self, section, company_data):
+        self.calls.append(section)
+        self.release.wait(5)
+        return f"{section} content"
+
+    def estimate_report(self, company_data, selected_reports):
+        sections = [detail for details in selected_reports.values() for detail in details]
+        return {"total_tokens": 1000 * len(sections), "latency_seconds": 1.0}
+
+
+@pytest.fixture
+def agent():
+    agent = StubAgent()
+    yield agent
+    agent.release.set()
+
+
+def started(cache, before=0):
+    """Wait for the debounce timer to submit or skip a speculation."""
+    deadline = time.monotonic() + 2
+    while time.monotonic() < deadline:
+        stats = cache.stats()
+        if stats["submitted"] + stats["skipped"] > before:
+            return stats
+        time.sleep(0.01)
+    raise AssertionError("speculation did not start")
+
+
+def test_cancelled_calls_are_refunded_to_the_session_budget(agent):
+    cache = SpeculativeCache(agent, delay=0, max_calls_per_session=4, max_workers=1)
+    cache.observe("s1", COMPANY)
+    assert started(cache)["submitted"] == 3
+    while not agent.calls:
+        time.sleep(0.01)
+
+    # One call is running on the only worker; the other two have not started and are refunded
+    cache.observe("s1", dict(COMPANY, financials="Revenue: $12M"))
+    stats = cache.stats()
+    assert (stats["cancelled"], stats["wasted"], stats["pending"]) == (2, 1, 0)
+    assert cache._sessions["s1"]["calls"] == 1
+
+    # The next speculation gets the rest of the budget, and submitted keeps counting
+    agent.release.set()
+    assert started(cache, before=3)["submitted"] == 6
+    assert cache._sessions["s1"]["calls"] == 4
+
+
+def test_take_uses_requested_sections_and_writes_off_the_rest(agent):
+    agent.release.set()
+    cache = SpeculativeCache(agent, delay=0, max_workers=3)
+    cache.observe("s1", COMPANY)
+    started(cache)
+
+    results = cache.take("s1", COMPANY, ["Company Overview", "Valuation"])
+    assert results == {"Company Overview": "Company Overview content"}
+    stats = cache.stats()
+    assert (stats["used"], stats["wasted"], stats["missed"]) == (1, 2, 0)
+    assert stats["hit_rate"] == pytest.approx(1 / 3)
+    # A second request for the same inputs has nothing left to hand over
+    assert cache.take("s1", COMPANY, ["Company Overview"]) == {}
+
+
+def test_speculation_reserves_tokens_with_the_admission_controller(agent):
+    admission = AdmissionController(max_concurrent=4, tokens_per_minute=5000)
+    cache = SpeculativeCache(agent, delay=0, admission=admission)
+    cache.observe("s1", COMPANY)
+    assert started(cache)["submitted"] == 3
+    assert admission.stats()["window_tokens"] == 3000
+
+    # Not enough of the token budget is left for a second session
+    cache.observe("s2", COMPANY)
+    stats = started(cache, before=3)
+    assert (stats["submitted"], stats["skipped"]) == (3, 3)
+    assert cache._sessions["s2"]["calls"] == 0
+
+
+def test_speculation_is_skipped_while_reports_wait(agent):
+    admission = AdmissionController(max_concurrent=1)
+    running = admission.enqueue("alice", {"total_tokens": 1000, "latency_seconds": 1.0})
+    assert admission.try_admit(running)
+    admission.enqueue("bob", {"total_tokens": 1000, "latency_seconds": 1.0})
+
+    cache = SpeculativeCache(agent, delay=0, admission=admission)
+    cache.observe("s1", COMPANY)
+    assert started(cache)["skipped"] == 3
+    assert agent.calls == []
@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Span currently active in this thread/task, used to link children to parents
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    A single timed operation within a report trace.
+    Spans form a tree through their parent_id and share the trace_id of the root.
+    """
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        """Start a span with the given name and optional attributes."""
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.thread_id = threading.get_ident()
+        # Wall clock for the timeline, perf/process counters for durations
+        self.start_time_us = time.time_ns() // 1000
+        self._start_perf = time.perf_counter()
+        self._start_cpu = time.thread_time()
+        self.duration_us = None
+        self.cpu_us = None
+
+    def set_attribute(self, key, value):
+        """Attach an attribute (topic, tokens, model, ...) to the span."""
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes):
+        """Attach several attributes at once."""
+        self.attributes.update(attributes)
+
+    def end(self):
+        """Stop the span's clocks."""
+        self.duration_us = int((time.perf_counter() - self._start_perf) * 1_000_000)
+        self.cpu_us = int((time.thread_time() - self._start_cpu) * 1_000_000)
+
+    def to_dict(self):
+        """Serialize the span to a JSON-compatible dictionary."""
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_us": self.start_time_us,
+            "duration_us": self.duration_us,
+            "cpu_us": self.cpu_us,
+            "thread_id": self.thread_id,
+            "pid": os.getpid(),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class JsonlExporter:
+    """Append finished spans to a JSON Lines file, one span per line."""
+
+    def __init__(self, path):
+        """Initialize the exporter with the output file path."""
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        """Write a finished span to the file."""
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class Tracer:
+    """
+    Creates spans and hands finished ones to an exporter.
+    Without an exporter spans are still timed but nothing is written.
+    """
+
+    def __init__(self, exporter=None):
+        """Initialize the tracer with an optional exporter."""
+        self.exporter = exporter
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Open a span as a child of the currently active span."""
+        parent = _current_span.get()
+        trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        span = Span(name, trace_id, parent.span_id if parent else None, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.set_attribute("error", f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+            if self.exporter is not None:
+                try:
+                    self.exporter.export(span)
+                except OSError:
+                    # Tracing must never break report generation
+                    pass
+
+
+def current_span():
+    """Return the active span, or None outside of any span."""
+    return _current_span.get()
+
+
+def record_usage(span, response):
+    """Copy token usage from an OpenAI response onto a span."""
+    usage = getattr(response, "usage", None)
+    if usage is None and isinstance(response, dict):
+        usage = response.get("usage")
+    if usage is None:
+        return
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        value = usage.get(key) if isinstance(usage, dict) else getattr(usage, key, None)
+        if value is not None:
+            span.set_attribute(key, value)
+
+
+_tracer = None
+
+
+def get_tracer():
+    """Return the process-wide tracer, exporting to FINANCE_TRACE_FILE when set."""
+    global _tracer
+    if _tracer is None:
+        path = os.getenv("FINANCE_TRACE_FILE")
+        _tracer = Tracer(JsonlExporter(path) if path else None)
+    return _tracer
+
+
+def load_spans(path):
+    """Read spans back from a JSONL trace file."""
+    spans = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                spans.append(json.loads(line))
+    return spans
+
+
+def to_chrome_trace(spans):
+    """
+    Convert spans to the Chrome trace event format.
+    Each trace gets its own row so reports can be compared side by side
+    in chrome://tracing or Perfetto.
+    """
+    trace_rows = {}
+    events = []
+    for span in sorted(spans, key=lambda s: s["start_us"]):
+        tid = trace_rows.setdefault(span["trace_id"], len(trace_rows) + 1)
+        args = dict(span.get("attributes", {}))
+        args["status"] = span.get("status", "ok")
+        if span.get("cpu_us") is not None:
+            args["cpu_ms"] = round(span["cpu_us"] / 1000, 3)
+        events.append({
+            "name": span["name"],
+            "cat": span["name"].split(".")[0],
+            "ph": "X",
+            "ts": span["start_us"],
+            "dur": span.get("duration_us") or 0,
+            "pid": span.get("pid", 1),
+            "tid": tid,
+            "args": args,
+        })
+    # Label each row with the trace id
+    for trace_id, tid in trace_rows.items():
+        events.append({
+            "name": "thread_name",
+            "ph": "M",
+            "pid": events[0]["pid"] if events else 1,
+            "tid": tid,
+            "args": {"name": f"trace {trace_id[:8]}"},
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def format_tree(spans):
+    """Render spans as an indented text tree with durations."""
+    children = {}
+    for span in spans:
+        children.setdefault(span.get("parent_id"), []).append(span)
+    for items in children.values():
+        items.sort(key=lambda s: s["start_us"])
+
+    lines = []
+
+    def walk(span, depth):
+        duration_ms = (span.get("duration_us") or 0) / 1000
+        attrs = ", ".join(f"{k}={v}" for k, v in span.get("attributes", {}).items())
+        lines.append(f"{'  ' * depth}{span['name']}  {duration_ms:.1f} ms" + (f"  [{attrs}]" if attrs else ""))
+        for child in children.get(span["span_id"], []):
+            walk(child, depth + 1)
+
+    for root in children.get(None, []):
+        walk(root, 0)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """Command-line viewer and Chrome trace converter for JSONL trace files."""
+    parser = argparse.ArgumentParser(description="Inspect report generation traces.")
+    parser.add_argument("trace_file", help="JSONL file written via FINANCE_TRACE_FILE")
+    parser.add_argument("--chrome", metavar="OUTPUT", help="Write a Chrome trace JSON file for chrome://tracing or Perfetto")
+    args = parser.parse_args(argv)
+
+    spans = load_spans(args.trace_file)
+    if args.chrome:
+        with open(args.chrome, "w", encoding="utf-8") as f:
+            json.dump(to_chrome_trace(spans), f)
+        print(f"Wrote {len(spans)} spans to {args.chrome}")
+    else:
+        print(format_tree(spans))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())